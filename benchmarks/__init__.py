@@ -0,0 +1,3 @@
+"""
+Benchmarks for Jokusoramame's hot paths.
+"""
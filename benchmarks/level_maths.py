@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for the level maths used by levelling.
+
+Compares the old numpy polynomial solver against the integer :func:`.get_level_from_exp`, and
+against :func:`.get_levels_from_exp_array` for whole arrays of XP values.
+
+Usage::
+
+    $ python -m benchmarks.level_maths
+"""
+import timeit
+
+import click
+import numpy as np
+from numpy.polynomial import Polynomial
+
+from jokusoramame.plugins.levelling import INCREASING_FACTOR, get_level_from_exp, \
+    get_levels_from_exp_array
+
+
+def polynomial_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    The polynomial root solver that levelling used to run.
+    """
+    if xp < a:
+        return 1
+
+    root = Polynomial([-xp, a / 2, a / 2]).roots()[1] + 1
+    return int(np.floor(root))
+
+
+@click.command()
+@click.option("--size", default=100_000, help="The number of XP values.")
+@click.option("--max-xp", default=10 ** 7, help="The largest XP value.")
+@click.option("--repeat", default=5, help="The number of times to run each implementation.")
+def main(size: int, max_xp: int, repeat: int):
+    """
+    Benchmarks the level maths.
+    """
+    values = np.random.randint(0, max_xp, size=size)
+    ints = values.tolist()
+
+    polynomial = min(timeit.repeat(lambda: [polynomial_level_from_exp(xp) for xp in ints],
+                                   number=1, repeat=repeat))
+    scalar = min(timeit.repeat(lambda: [get_level_from_exp(xp) for xp in ints],
+                               number=1, repeat=repeat))
+    array = min(timeit.repeat(lambda: get_levels_from_exp_array(values),
+                              number=1, repeat=repeat))
+
+    click.echo(f"{size} XP values up to {max_xp}")
+    click.echo(f"  polynomial: {polynomial * 1e9 / size:.0f}ns per value")
+    click.echo(f"  integer:    {scalar * 1e9 / size:.0f}ns per value "
+               f"({polynomial / scalar:.1f}x)")
+    click.echo(f"  array:      {array * 1e9 / size:.1f}ns per value "
+               f"({polynomial / array:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Synthetic-load benchmark for the levelling plugin.
+
+Drives :meth:`.Levelling.update_levels`, ``level``, ``xp`` and ``level leaderboard`` with fake
+messages and members against a local Postgres database, and reports throughput, handler
+latency and the number of rows transferred per event.
+
+Usage::
+
+    $ python -m benchmarks.levelling --dsn postgresql://localhost/joku_bench
+
+The database is **wiped**; never point this at a real one.
+"""
+import random
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import asyncpg
+import click
+import curio
+import multio
+import numpy as np
+import tabulate
+from asyncqlio import DatabaseInterface
+
+from jokusoramame.db.connector import CurioAsyncpgConnector, CurioAsyncpgResultSet, \
+    CurioAsyncpgTransaction
+from jokusoramame.plugins import levelling
+from jokusoramame.plugins.levelling import Levelling
+from jokusoramame.utils import loop
+from jokusoramame.xpbuffer import XPBuffer
+
+GUILD_ID = 198101180180594688
+
+#: The schema the benchmark runs against, matching the migrations.
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS user_xp;
+CREATE TABLE user_xp (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT,
+    guild_id BIGINT NOT NULL,
+    xp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 1,
+    UNIQUE (user_id, guild_id)
+);
+CREATE INDEX user_xp_xp_idx ON user_xp (xp);
+CREATE INDEX user_xp_guild_id_idx ON user_xp (guild_id);
+CREATE INDEX user_xp_guild_id_xp_id_idx ON user_xp (guild_id, xp, id);
+"""
+
+
+class Counters(object):
+    """
+    Counts the database traffic caused by the handlers.
+    """
+    queries = 0
+    rows = 0
+
+    @classmethod
+    def reset(cls):
+        cls.queries = 0
+        cls.rows = 0
+
+
+class CountingResultSet(CurioAsyncpgResultSet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        fetch_row, fetch_many = self.fetch_row, self.fetch_many
+
+        async def counting_fetch_row():
+            row = await fetch_row()
+            if row is not None:
+                Counters.rows += 1
+            return row
+
+        async def counting_fetch_many(n: int):
+            rows = await fetch_many(n)
+            Counters.rows += len(rows)
+            return rows
+
+        self.fetch_row = counting_fetch_row
+        self.fetch_many = counting_fetch_many
+
+
+class CountingTransaction(CurioAsyncpgTransaction):
+    async def execute(self, sql: str, params=None):
+        Counters.queries += 1
+        return await super().execute(sql, params)
+
+    async def cursor(self, sql: str, params=None):
+        Counters.queries += 1
+        res = await super().cursor(sql, params)
+        return CountingResultSet(cur=res.cur)
+
+
+class CountingConnector(CurioAsyncpgConnector):
+    def get_transaction(self):
+        return CountingTransaction(self)
+
+
+# Fake discord objects, with just enough on them for the levelling plugin.
+
+class FakeMessages(object):
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.name = "general"
+        self.messages = FakeMessages()
+        self.me_permissions = type("Permissions", (), {"add_reactions": True})()
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeUser(object):
+    def __init__(self, id: int):
+        self.id = id
+        self.bot = False
+        self.name = self.username = f"user{id}"
+        self.static_avatar_url = self.avatar_url = "https://example.com/avatar.png"
+        self.mention = f"<@{id}>"
+
+
+class FakeMember(object):
+    def __init__(self, id: int, guild: 'FakeGuild'):
+        self.id = id
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = FakeUser(id)
+        self.nickname = self.user.name
+        self.mention = self.user.mention
+        self.colour = 0xabcdef
+
+
+class FakeGuild(object):
+    def __init__(self, id: int, size: int):
+        self.id = id
+        self.name = f"guild{id}"
+        self.members: Dict[int, FakeMember] = {}
+        for user_id in range(1, size + 1):
+            self.members[user_id] = FakeMember(user_id, self)
+
+
+class FakeMessage(object):
+    def __init__(self, author: FakeMember, channel: FakeChannel):
+        self.guild = author.guild
+        self.guild_id = author.guild_id
+        self.author = author
+        self.author_id = author.id
+        self.channel = channel
+        self.channel_id = 1
+        self.content = "hello world"
+
+
+class FakeContext(object):
+    def __init__(self, bot: 'FakeBot', author: FakeMember, channel: FakeChannel):
+        self.bot = bot
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel
+        self.tokens = []
+
+
+class FakeBot(object):
+    def __init__(self, db: DatabaseInterface):
+        self.db = db
+        self.config = {"levelling": {"cooldown": 0}}
+        self.xp_buffer = XPBuffer(db)
+        self.redis = None
+
+
+class FirstPagePaginator(object):
+    """
+    Stands in for the reactions paginator, rendering only the first page like a user would see.
+    """
+
+    def __init__(self, render, page_count: int, **kwargs):
+        self._render = render
+
+    async def paginate(self):
+        await self._render(0)
+
+
+async def seed(dsn: str, size: int):
+    """
+    Creates the schema and fills the guild with ``size`` ranked users.
+    """
+    conn: asyncpg.Connection = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(SCHEMA_SQL)
+        xp = np.random.zipf(1.5, size).clip(0, 2_000_000)
+        levels = levelling.get_levels_from_exp_array(xp)
+        records = [(user_id, GUILD_ID, int(x), int(level))
+                   for user_id, x, level in zip(range(1, size + 1), xp, levels)]
+        await conn.copy_records_to_table("user_xp", records=records,
+                                         columns=["user_id", "guild_id", "xp", "level"])
+        await conn.execute("ANALYZE user_xp;")
+    finally:
+        await conn.close()
+
+
+async def measure(name: str, count: int, handler: Callable[[], Awaitable[None]]) -> List[str]:
+    """
+    Runs a handler ``count`` times, and formats its statistics.
+    """
+    Counters.reset()
+    latencies = []
+
+    start = time.perf_counter()
+    for _ in range(count):
+        before = time.perf_counter()
+        await handler()
+        latencies.append(time.perf_counter() - before)
+    taken = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) * 1000
+    return [name, count, f"{count / taken:.1f}", f"{np.percentile(latencies, 50):.3f}",
+            f"{np.percentile(latencies, 99):.3f}", f"{Counters.queries / count:.2f}",
+            f"{Counters.rows / count:.2f}"]
+
+
+async def run_size(dsn: str, size: int, messages: int, commands: int) -> List[List[str]]:
+    """
+    Runs the benchmark for a single guild size.
+    """
+    await loop.run_asyncio(seed, dsn, size)
+
+    db = DatabaseInterface(dsn, connector=CountingConnector)
+    await db.connect()
+
+    bot = FakeBot(db)
+    plugin = Levelling(bot)
+    guild = FakeGuild(GUILD_ID, size)
+    channel = FakeChannel()
+    members = list(guild.members.values())
+
+    async def update_levels():
+        message = FakeMessage(random.choice(members), channel)
+        await plugin.update_levels(FakeContext(bot, message.author, channel), message)
+
+    async def level():
+        await plugin.level(FakeContext(bot, random.choice(members), channel))
+
+    async def xp():
+        await plugin.xp(FakeContext(bot, random.choice(members), channel))
+
+    async def leaderboard():
+        await plugin.leaderboard(FakeContext(bot, random.choice(members), channel))
+
+    results = [await measure("update_levels", messages, update_levels)]
+
+    before = time.perf_counter()
+    flushed = await bot.xp_buffer.flush()
+    results.append(["xp_buffer.flush", flushed, "-", f"{(time.perf_counter() - before) * 1000:.3f}",
+                    "-", "-", "-"])
+
+    results.append(await measure("level", commands, level))
+    results.append(await measure("xp", commands, xp))
+    results.append(await measure("leaderboard", commands, leaderboard))
+
+    await db.close()
+    return results
+
+
+@click.command()
+@click.option("--dsn", required=True, help="The DSN of a throwaway Postgres database.")
+@click.option("--sizes", default="1000,10000,100000", help="Comma-separated guild sizes.")
+@click.option("--messages", default=10_000, help="The number of messages to send per size.")
+@click.option("--commands", default=200, help="The number of each command to run per size.")
+def main(dsn: str, sizes: str, messages: int, commands: int):
+    """
+    Benchmarks the levelling plugin.
+    """
+    multio.init("curio")
+    levelling.LazyReactionsPaginator = FirstPagePaginator
+    headers = ["Handler", "Events", "Events/sec", "p50 (ms)", "p99 (ms)", "Queries/event",
+               "Rows/event"]
+
+    try:
+        for size in map(int, sizes.split(",")):
+            results = curio.run(run_size(dsn, size, messages, commands))
+            click.echo(f"\nGuild size: {size}")
+            click.echo(tabulate.tabulate(results, headers, tablefmt="orgtbl"))
+    finally:
+        curio.run(loop.shutdown())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark for the analytics message record format.
+
+Compares the size and decoding speed of the legacy zlib-compressed JSON records against
+:func:`.encode_record` over 5000-message histories. With ``--host``, both histories are also
+written to Redis and their ``MEMORY USAGE`` is reported.
+
+Usage::
+
+    $ python -m benchmarks.records --host 127.0.0.1
+"""
+import json
+import random
+import time
+import timeit
+import zlib
+
+import click
+import redis
+
+from jokusoramame.records import decode_record, encode_record
+
+WORDS = ["hello", "world", "the", "quick", "brown", "fox", "LOL", "joku", "is", "a", "bot",
+         "what", "ok", "👀", "über", "MESSAGE", "no", "yes", "?", "!!", "lmao", "I'm", "don't",
+         "really", "think", "that", "<@198101180180594688>", "https://i.imgur.com/xyz.png"]
+
+
+def make_history(size: int) -> list:
+    """
+    Makes a history of ``size`` fake chat messages, as (content, timestamp, channel_id).
+    """
+    now = time.time()
+    return [(" ".join(random.choices(WORDS, k=random.randint(0, 20))), now - i * 60,
+             381963689470984203) for i in range(size)]
+
+
+def encode_legacy(content: str, timestamp: float, channel_id: int) -> bytes:
+    """
+    Encodes a message the way it used to be stored.
+    """
+    return zlib.compress(json.dumps({"c": content, "dt": timestamp, "ch": channel_id}).encode())
+
+
+@click.command()
+@click.option("--size", default=5000, help="The number of messages per history.")
+@click.option("--repeat", default=10, help="The number of times to decode each history.")
+@click.option("--host", default=None, help="A redis host to measure memory usage on.")
+@click.option("--port", default=6379, help="The redis port.")
+def main(size: int, repeat: int, host: str, port: int):
+    """
+    Benchmarks the message record formats.
+    """
+    history = make_history(size)
+    formats = {"legacy": [encode_legacy(*message) for message in history],
+               "compact": [encode_record(*message) for message in history]}
+
+    click.echo(f"{size} messages")
+    for name, records in formats.items():
+        taken = min(timeit.repeat(lambda: [decode_record(raw) for raw in records],
+                                  number=1, repeat=repeat))
+        click.echo(f"  {name}: {sum(map(len, records))} bytes, decoded in {taken * 1000:.2f}ms")
+
+    if host is None:
+        return
+
+    client = redis.Redis(host=host, port=port)
+    for name, records in formats.items():
+        key = f"records_benchmark_{name}"
+        client.delete(key)
+        client.rpush(key, *records)
+        usage = client.memory_usage(key, samples=0)
+        client.delete(key)
+        click.echo(f"  {name}: {usage} bytes in redis")
+
+
+if __name__ == '__main__':
+    main()
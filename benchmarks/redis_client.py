@@ -0,0 +1,193 @@
+"""
+Throughput comparison of the Redis clients.
+
+Runs the same workload through the previous thread-per-call interface (synchronous redis-py
+wrapped in ``async_thread``) and the pooled asyncio client used by :class:`.RedisInterface`,
+with a number of concurrent curio tasks, and reports operations per second and latency.
+
+Usage::
+
+    $ python -m benchmarks.redis_client --host 127.0.0.1 --concurrency 1,16,64
+
+Only keys for the fake guild and users below are touched, and they are deleted afterwards.
+"""
+import datetime
+import json
+import random
+import time
+import zlib
+from typing import Awaitable, Callable, List
+
+import click
+import curio
+import multio
+import numpy as np
+import redis
+import tabulate
+from curio.thread import async_thread
+
+from jokusoramame.redis import MAX_MESSAGES, RedisInterface
+from jokusoramame.textstats import message_stats
+from jokusoramame.utils import loop
+
+GUILD_ID = 1
+USER_COUNT = 1000
+WORDS = "the quick brown fox jumps over a lazy dog while joku watches".split()
+
+
+class FakeUser(object):
+    def __init__(self, id: int):
+        self.id = id
+        self.user = self
+
+
+class FakeMessage(object):
+    def __init__(self, user_id: int):
+        self.guild_id = GUILD_ID
+        self.author = FakeUser(user_id)
+        self.author_id = user_id
+        self.channel_id = 1
+        self.created_at = datetime.datetime.now()
+        self.content = " ".join(random.choices(WORDS, k=random.randint(3, 20)))
+
+
+class ThreadedRedis(object):
+    """
+    The previous interface, doing synchronous redis-py I/O in a thread per call.
+    """
+
+    def __init__(self, host: str, port: int, password: str):
+        self.redis = redis.Redis(host=host, port=port, password=password)
+
+    @async_thread
+    def add_message(self, message: FakeMessage):
+        if self.redis.get(f"analytics_enabled_{message.guild_id}") is None:
+            return
+
+        if self.redis.get(f"analytics_flag_{message.author.user.id}") is not None:
+            return
+
+        key = f"messages_{message.author_id}"
+        body = json.dumps({
+            "c": message.content,
+            "dt": message.created_at.timestamp(),
+            "ch": message.channel_id
+        })
+        stats_key = f"analytics_stats_{message.author_id}"
+        pipeline = self.redis.pipeline()
+        with pipeline:
+            pipeline.exists(stats_key)
+            pipeline.lpush(key, zlib.compress(body.encode()))
+            pipeline.lrange(key, MAX_MESSAGES + 1, -1)
+            pipeline.ltrim(key, 0, MAX_MESSAGES)
+            for field, value in message_stats(message.content).items():
+                pipeline.hincrbyfloat(stats_key, field, value)
+            pipeline.execute()
+
+    @async_thread
+    def start_xp_cooldown(self, guild_id: int, user_id: int, seconds: int) -> bool:
+        key = f"xp_cooldown_{guild_id}_{user_id}"
+        return bool(self.redis.set(key, "\x07", nx=True, ex=seconds))
+
+    @async_thread
+    def get_xp(self, guild_id: int, user_id: int):
+        return self.redis.zscore(f"xp_rank_{guild_id}", user_id)
+
+
+async def measure(name: str, concurrency: int, count: int,
+                  operation: Callable[[], Awaitable[None]]) -> List[str]:
+    """
+    Runs ``count`` operations over ``concurrency`` tasks, and formats their statistics.
+    """
+    latencies = []
+
+    async def worker(n: int):
+        for _ in range(n):
+            before = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - before)
+
+    start = time.perf_counter()
+    async with curio.TaskGroup() as group:
+        for _ in range(concurrency):
+            await group.spawn(worker, count // concurrency)
+    taken = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) * 1000
+    return [name, concurrency, len(latencies), f"{len(latencies) / taken:.1f}",
+            f"{np.percentile(latencies, 50):.3f}", f"{np.percentile(latencies, 99):.3f}"]
+
+
+async def cleanup(client: redis.Redis):
+    """
+    Deletes every key the benchmark created.
+    """
+    keys = [f"analytics_enabled_{GUILD_ID}", f"xp_rank_{GUILD_ID}"]
+    for user_id in range(1, USER_COUNT + 1):
+        keys += [f"messages_{user_id}", f"analytics_stats_{user_id}",
+                 f"xp_cooldown_{GUILD_ID}_{user_id}"]
+    await curio.run_in_thread(client.delete, *keys)
+
+
+async def run(host: str, port: int, password: str, pool_size: int, concurrency: List[int],
+              count: int) -> List[List[str]]:
+    """
+    Runs every workload against both clients.
+    """
+    threaded = ThreadedRedis(host, port, password)
+    pooled = RedisInterface(host, port, password, pool_size=pool_size)
+
+    await curio.run_in_thread(threaded.redis.set, f"analytics_enabled_{GUILD_ID}", "\x07")
+    await curio.run_in_thread(threaded.redis.zadd, f"xp_rank_{GUILD_ID}",
+                              {user_id: user_id for user_id in range(1, USER_COUNT + 1)})
+
+    def user_id() -> int:
+        return random.randint(1, USER_COUNT)
+
+    results = []
+    try:
+        for tasks in concurrency:
+            for name, client in (("thread-per-call", threaded), ("pooled asyncio", pooled)):
+                results.append(await measure(
+                    f"add_message ({name})", tasks, count,
+                    lambda: client.add_message(FakeMessage(user_id()))
+                ))
+                results.append(await measure(
+                    f"start_xp_cooldown ({name})", tasks, count,
+                    lambda: client.start_xp_cooldown(GUILD_ID, user_id(), 1)
+                ))
+                results.append(await measure(
+                    f"get_xp ({name})", tasks, count,
+                    lambda: client.get_xp(GUILD_ID, user_id())
+                ))
+    finally:
+        await cleanup(threaded.redis)
+        await pooled.close()
+
+    return results
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="The redis host.")
+@click.option("--port", default=6379, help="The redis port.")
+@click.option("--password", default=None, help="The redis password.")
+@click.option("--pool-size", default=16, help="The pool size of the asyncio client.")
+@click.option("--concurrency", default="1,16,64", help="Comma-separated concurrent task counts.")
+@click.option("--count", default=5000, help="The number of operations per workload.")
+def main(host: str, port: int, password: str, pool_size: int, concurrency: str, count: int):
+    """
+    Compares the throughput of the Redis clients.
+    """
+    multio.init("curio")
+    headers = ["Workload", "Tasks", "Operations", "Ops/sec", "p50 (ms)", "p99 (ms)"]
+
+    try:
+        results = curio.run(run(host, port, password, pool_size,
+                                list(map(int, concurrency.split(","))), count))
+        click.echo(tabulate.tabulate(results, headers, tablefmt="orgtbl"))
+    finally:
+        curio.run(loop.shutdown())
+
+
+if __name__ == '__main__':
+    main()
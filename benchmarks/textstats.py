@@ -0,0 +1,64 @@
+"""
+Benchmark for the batch text statistics used by analytics.
+
+Compares :func:`.batch_stats` against the old per-message loop over 5000-message histories.
+
+Usage::
+
+    $ python -m benchmarks.textstats
+"""
+import random
+import string
+import timeit
+
+import click
+import entropy
+
+from jokusoramame.textstats import batch_stats
+
+WORDS = ["hello", "world", "the", "quick", "brown", "fox", "LOL", "joku", "is", "a", "bot",
+         "what", "ok", "👀", "über", "MESSAGE", "no", "yes", "?", "!!"]
+
+
+def make_history(size: int) -> list:
+    """
+    Makes a history of ``size`` fake chat messages.
+    """
+    return [" ".join(random.choices(WORDS, k=random.randint(0, 20))) for _ in range(size)]
+
+
+def loop_stats(contents: list):
+    """
+    The per-message loop that analytics used to run.
+    """
+    total_entropy = total_length = capitals = 0
+    for content in contents:
+        if not content:
+            continue
+
+        total_entropy += entropy.shannon_entropy(content)
+        total_length += len(content)
+        capitals += sum(char in string.ascii_uppercase for char in content)
+
+    return total_entropy, total_length, capitals
+
+
+@click.command()
+@click.option("--size", default=5000, help="The number of messages per history.")
+@click.option("--repeat", default=20, help="The number of times to run each implementation.")
+def main(size: int, repeat: int):
+    """
+    Benchmarks the text statistics.
+    """
+    contents = make_history(size)
+
+    looped = min(timeit.repeat(lambda: loop_stats(contents), number=1, repeat=repeat))
+    batched = min(timeit.repeat(lambda: batch_stats(contents), number=1, repeat=repeat))
+
+    click.echo(f"{size} messages")
+    click.echo(f"  loop:  {looped * 1000:.2f}ms")
+    click.echo(f"  batch: {batched * 1000:.2f}ms ({looped / batched:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 import math
-import threading
 import time
 import traceback
 
+import curio
 import logbook
 from asyncqlio import DatabaseInterface
 from curious import BotType, Client, EventContext, Game, Message, Status, event
@@ -12,8 +12,12 @@ from curious.commands.exc import CommandInvokeError, CommandRateLimited, Command
 from curious.exc import CuriousError, HTTPException
 
 from jokusoramame.db.connector import CurioAsyncpgConnector
+from jokusoramame.http import HTTPClient, ResponseCache
+from jokusoramame.ingest import AnalyticsQueue
+from jokusoramame.plotting import PlotService, PlottingError
 from jokusoramame.redis import RedisInterface
 from jokusoramame.utils import display_time
+from jokusoramame.xpbuffer import XPBuffer
 
 logger = logbook.Logger("Jokusoramame")
 
@@ -42,18 +46,51 @@ class Jokusoramame(Client):
         self.db = DatabaseInterface(self.config.get("db_url"),
                                     connector=CurioAsyncpgConnector)
 
+        #: The write-behind levelling XP buffer.
+        levelling = self.config.get("levelling", {})
+        self.xp_buffer = XPBuffer(self.db, flush_interval=levelling.get("flush_interval", 5))
+
         #: The redis interface.
         self.redis = RedisInterface(**self.config["redis"])
 
-        #: The plotting lock. Used for pyplot compatability.
-        self._plot_lock = threading.Lock()
+        #: The analytics message ingestion queue.
+        analytics = self.config.get("analytics", {})
+        self.analytics_queue = AnalyticsQueue(
+            self.redis, batch_size=analytics.get("batch_size", 500),
+            flush_interval=analytics.get("flush_interval_ms", 250) / 1000,
+            max_depth=analytics.get("max_queue_depth", 50_000)
+        )
+
+        #: The shared HTTP sessions for outbound API calls.
+        http = dict(self.config.get("http", {}))
+        response_cache = http.pop("response_cache", {})
+        self.http_sessions = HTTPClient(**http)
+
+        #: The cache of text analysis API responses.
+        self.api_cache = ResponseCache(
+            size=response_cache.get("size", 10_000),
+            default_ttl=response_cache.get("default_ttl", 3600),
+            ttls=response_cache.get("ttls"),
+            redis=self.redis if response_cache.get("redis") else None
+        )
+
+        #: The plot rendering service.
+        plotting = self.config.get("plotting", {})
+        self.plots = PlotService(workers=plotting.get("workers"),
+                                 max_queued=plotting.get("max_queued", 16),
+                                 timeout=plotting.get("timeout", 30),
+                                 cache_size=plotting.get("cache_bytes", 64 * 1024 ** 2),
+                                 redis=self.redis if plotting.get("redis_cache") else None,
+                                 redis_ttl=plotting.get("redis_cache_ttl", 3600))
 
         self._loaded = False
 
     @event("command_error")
     async def command_error(self, ev_ctx: EventContext, ctx: Context, error: CommandsError):
         if isinstance(error, CommandInvokeError):
-            if self.config.get("dev_mode"):
+            if isinstance(error.__cause__, PlottingError):
+                await ctx.channel.messages.send(f":x: {error.__cause__}")
+            elif self.config.get("dev_mode"):
                 tb = traceback.format_exception(None,
                                                 error.__cause__,
                                                 error.__cause__.__traceback__)
@@ -106,6 +143,10 @@ class Jokusoramame(Client):
             await self._kill()
             raise
 
+        await curio.spawn(self.xp_buffer.run(), daemon=True)
+        await curio.spawn(self.redis.listen_invalidations(), daemon=True)
+        await curio.spawn(self.analytics_queue.run(), daemon=True)
+
         plugins = self.config.get("autoload", [])
         if "jokusoramame.plugins.core" not in plugins:
             plugins.insert(0, "jokusoramame.plugins.core")
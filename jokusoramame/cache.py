@@ -0,0 +1,105 @@
+"""
+Generic in-process caches.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, Optional, Tuple
+
+
+class SizedLRU(object):
+    """
+    A least recently used cache bounded by the total size of its values, rather than their
+    number, with an optional time to live.
+
+    Sizes are given by the caller when setting a value, in whatever unit ``max_size`` is in
+    (normally bytes).
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """
+        :param max_size: The maximum total size of the cached values.
+        :param ttl: The number of seconds a value lives for, or None to keep values forever.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        #: key -> (value, size, expiry time), least recently used first.
+        self._entries: OrderedDict = OrderedDict()
+
+        #: The total size of the cached values.
+        self.size = 0
+
+        #: The number of hits, misses and evictions so far.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries.keys()))
+
+    def _lookup(self, key: Hashable) -> Optional[Tuple[Any, int, float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry[2] < time.monotonic():
+            self.pop(key)
+            return None
+
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Gets a value, marking it as recently used.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: int):
+        """
+        Sets a value, evicting the least recently used values until everything fits.
+
+        Values bigger than the whole cache are not stored.
+        """
+        self.pop(key)
+        if size > self.max_size:
+            return
+
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        self._entries[key] = (value, size, expiry)
+        self.size += size
+
+        while self.size > self.max_size:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes a value, returning it.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        """
+        Removes every value.
+        """
+        self._entries.clear()
+        self.size = 0
@@ -0,0 +1,254 @@
+"""
+The shared HTTP client for outbound API calls, and a cache for their responses.
+"""
+import hashlib
+import json
+import time
+import unicodedata
+from functools import partialmethod
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import asks
+import curio
+from asks.response_objects import Response
+from lru import LRU
+
+from jokusoramame import USER_AGENT
+from jokusoramame.redis import RedisInterface
+
+
+class CountingSession(asks.Session):
+    """
+    An asks session that keeps its connections alive between requests, and counts how often it
+    had to open a new one.
+    """
+
+    def __init__(self, *args, timeout: float = None, **kwargs):
+        """
+        :param timeout: The default number of seconds a request may take.
+        """
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+        #: The number of requests made, and of connections opened for them.
+        self.requests = 0
+        self.connections_opened = 0
+
+    async def _make_connection(self, host_loc):
+        self.connections_opened += 1
+        return await super()._make_connection(host_loc)
+
+    async def request(self, method: str, *args, **kwargs) -> Response:
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+
+        self.requests += 1
+        return await super().request(method, *args, **kwargs)
+
+    # the base class binds these to its own request
+    get = partialmethod(request, "GET")
+    head = partialmethod(request, "HEAD")
+    post = partialmethod(request, "POST")
+    put = partialmethod(request, "PUT")
+    delete = partialmethod(request, "DELETE")
+
+
+class HTTPClient(object):
+    """
+    A registry of keep-alive sessions, one per host, so that repeated requests to the same API
+    reuse their connections rather than doing a new TCP and TLS handshake each time.
+    """
+
+    def __init__(self, connections: int = 8, timeout: float = 30,
+                 hosts: Dict[str, dict] = None):
+        """
+        :param connections: The default maximum number of concurrent connections per host.
+        :param timeout: The default number of seconds a request may take.
+        :param hosts: Per-host overrides of ``connections`` and ``timeout``, keyed by hostname.
+        """
+        self.connections = connections
+        self.timeout = timeout
+        self.hosts = hosts or {}
+
+        #: scheme://host[:port] -> session.
+        self._sessions: Dict[str, CountingSession] = {}
+
+    def session(self, url: str) -> CountingSession:
+        """
+        Gets the session for the host of a URL, creating it if needed.
+        """
+        parts = urlsplit(url)
+        location = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(location)
+        if session is None:
+            config = self.hosts.get(parts.hostname, {})
+            session = CountingSession(headers={"User-Agent": USER_AGENT},
+                                      connections=config.get("connections", self.connections),
+                                      timeout=config.get("timeout", self.timeout))
+            self._sessions[location] = session
+
+        return session
+
+    async def request(self, method: str, url: str, **kwargs) -> Response:
+        """
+        Makes a request with the session for its host.
+
+        :param method: The HTTP method to use.
+        :param url: The URL to request.
+        :param kwargs: Passed to :meth:`asks.Session.request`; any headers given are merged over
+            the default ones.
+        """
+        return await self.session(url).request(method, url, **kwargs)
+
+    get = partialmethod(request, "GET")
+    post = partialmethod(request, "POST")
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Gets the connection reuse statistics of every host.
+
+        :return: A dict of location -> requests made, connections opened, and requests that
+            reused a connection.
+        """
+        return {location: {"requests": session.requests,
+                           "connections": session.connections_opened,
+                           "reused": session.requests - session.connections_opened}
+                for (location, session) in self._sessions.items()}
+
+
+class CachedResponse(object):
+    """
+    The parts of a successful response that are kept in the :class:`.ResponseCache`. Has the same
+    ``status_code``, ``content``, ``text`` and ``json()`` as an asks response.
+    """
+
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class _Flight(object):
+    """
+    A request in flight, that identical requests wait on instead of making their own.
+    """
+
+    def __init__(self):
+        self.done = curio.Event()
+        self.response = None
+        self.error = None
+
+
+class ResponseCache(object):
+    """
+    Caches successful API responses by endpoint and normalised request text, in an LRU with
+    per-endpoint TTLs and optionally in Redis.
+
+    Identical requests made while one is already in flight wait for its response rather than
+    making their own.
+    """
+
+    def __init__(self, size: int = 10_000, default_ttl: float = 3600,
+                 ttls: Dict[str, float] = None, redis: Optional[RedisInterface] = None):
+        """
+        :param size: The maximum number of responses to keep in this process.
+        :param default_ttl: The number of seconds responses are kept for.
+        :param ttls: Per-endpoint overrides of ``default_ttl``.
+        :param redis: The :class:`.RedisInterface` to also cache responses in, if any.
+        """
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.redis = redis
+
+        #: (endpoint, normalised text) -> (response, expiry time).
+        self._responses = LRU(size)
+
+        #: (endpoint, normalised text) -> the request in flight.
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+
+        #: The number of hits (including coalesced requests) and misses so far.
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalise(text: str) -> str:
+        """
+        Normalises request text, so that trivially different requests share a response.
+
+        Only Unicode forms and whitespace are normalised; case can change the analysis.
+        """
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    def _store(self, key: Tuple[str, str], response: CachedResponse):
+        ttl = self.ttls.get(key[0], self.default_ttl)
+        self._responses[key] = (response, time.monotonic() + ttl)
+
+    async def _fetch(self, key: Tuple[str, str],
+                     fetch: Callable[[], Awaitable[Response]]) -> Response:
+        digest = hashlib.blake2b(key[1].encode(), digest_size=20).hexdigest()
+        redis_key = f"api_response_{key[0]}_{digest}"
+        if self.redis is not None:
+            content = await self.redis.get_api_response(redis_key)
+            if content is not None:
+                response = CachedResponse(content)
+                self._store(key, response)
+                return response
+
+        response = await fetch()
+        if response.status_code != 200:
+            # errors are never cached
+            return response
+
+        cached = CachedResponse(response.content)
+        self._store(key, cached)
+        if self.redis is not None:
+            ttl = self.ttls.get(key[0], self.default_ttl)
+            await self.redis.set_api_response(redis_key, cached.content, int(ttl))
+
+        return cached
+
+    async def get(self, endpoint: str, text: str,
+                  fetch: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        Gets the response to a request, making it only if it isn't cached or already in flight.
+
+        :param endpoint: The name of the endpoint, which also selects the TTL.
+        :param text: The text being sent to the endpoint.
+        :param fetch: A coroutine function that makes the request.
+        :return: The response; only successful ones are cached.
+        """
+        key = (endpoint, self.normalise(text))
+        cached = self._responses.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self.hits += 1
+            return cached[0]
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.hits += 1
+            await flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            elif flight.response is None:
+                raise RuntimeError("The identical request in flight was cancelled")
+
+            return flight.response
+
+        self.misses += 1
+        flight = self._flights[key] = _Flight()
+        try:
+            flight.response = await self._fetch(key, fetch)
+            return flight.response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            del self._flights[key]
+            await flight.done.set()
@@ -0,0 +1,175 @@
+"""
+Coalesced ingestion of analytics messages.
+"""
+import time
+from collections import Counter, deque
+from typing import Dict, List, Tuple
+
+import curio
+import logbook
+import numpy as np
+from curious import Message
+
+from jokusoramame.records import encode_record
+from jokusoramame.redis import RedisInterface, activity_bucket
+
+logger = logbook.Logger("Jokusoramame.ingest")
+
+
+class AnalyticsQueue(object):
+    """
+    Queues analytics messages and stores them in Redis in batches.
+
+    The queue is flushed every ``flush_interval`` seconds, or as soon as ``batch_size`` messages
+    are waiting, whichever comes first.
+    """
+
+    def __init__(self, redis: RedisInterface, batch_size: int = 500,
+                 flush_interval: float = 0.25, max_depth: int = 50_000):
+        """
+        :param redis: The :class:`.RedisInterface` to store messages with.
+        :param batch_size: The number of queued messages that triggers a flush.
+        :param flush_interval: The maximum number of seconds a message waits to be stored.
+        :param max_depth: The number of queued messages after which new ones are dropped, for
+            when Redis is unavailable.
+        """
+        self.redis = redis
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+
+        #: user_id -> list of (record, content, activity bucket) waiting to be stored, oldest
+        #: first.
+        self._pending: Dict[int, List[Tuple[bytes, str, Tuple[str, str]]]] = {}
+
+        #: The number of messages in ``_pending``.
+        self.depth = 0
+
+        #: The batch being stored by :meth:`.flush`, in the same form as ``_pending``.
+        self._inflight: Dict[int, List[Tuple[bytes, str, Tuple[str, str]]]] = {}
+        self._flush_lock = curio.Lock()
+
+        #: Set when a full batch is waiting.
+        self._full = curio.Event()
+
+        #: guild_id -> the number of messages queued for that guild since startup. Used as a
+        #: watermark to tell how stale cached analytics results are.
+        self.guild_counts = Counter()
+
+        #: The number of flushes, messages stored and messages dropped so far.
+        self.flushes = 0
+        self.stored = 0
+        self.dropped = 0
+
+        #: The sizes and latencies (in seconds) of recent flushes.
+        self.flush_sizes = deque(maxlen=1000)
+        self.flush_latencies = deque(maxlen=1000)
+
+    async def add(self, message: Message):
+        """
+        Queues a message, if analytics are enabled for it.
+        """
+        enabled, opted_out = await self.redis.get_analytics_flags(message.guild_id,
+                                                                  message.author.user.id)
+        if not enabled or opted_out:
+            return
+
+        if self.depth >= self.max_depth:
+            self.dropped += 1
+            return
+
+        timestamp = message.created_at.timestamp()
+        record = encode_record(message.content, timestamp, message.channel_id)
+        bucket = activity_bucket(message.guild_id, message.channel_id, timestamp)
+        self._pending.setdefault(message.author_id, []).append((record, message.content, bucket))
+        self.depth += 1
+        self.guild_counts[message.guild_id] += 1
+
+        if self.depth >= self.batch_size and not self._full.is_set():
+            await self._full.set()
+
+    async def discard(self, user_id: int) -> bool:
+        """
+        Drops every queued message of a user, along with their activity counts.
+
+        :return: If some of the user's messages were already being stored, and so might have
+            been stored anyway.
+        """
+        in_flight = user_id in self._inflight
+        if in_flight:
+            # wait for the batch, which is put back in the queue if it fails
+            async with self._flush_lock:
+                pass
+
+        dropped = self._pending.pop(user_id, [])
+        self.depth -= len(dropped)
+        return in_flight
+
+    async def flush(self) -> int:
+        """
+        Stores every queued message.
+
+        :return: The number of messages stored.
+        """
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        depth, self.depth = self.depth, 0
+        self._inflight = pending
+
+        messages = {user_id: [(record, content) for (record, content, _) in queued]
+                    for (user_id, queued) in pending.items()}
+        activity = Counter(bucket for queued in pending.values() for (_, _, bucket) in queued)
+
+        before = time.perf_counter()
+        try:
+            await self.redis.store_messages(messages, activity)
+        except Exception:
+            # store_messages only raises if nothing was stored, so the batch can be retried
+            # put everything back in front of anything queued meanwhile, so order is kept
+            for user_id, queued in pending.items():
+                self._pending[user_id] = queued + self._pending.get(user_id, [])
+            self.depth += depth
+            raise
+        finally:
+            self._inflight = {}
+
+        self.flushes += 1
+        self.stored += depth
+        self.flush_sizes.append(depth)
+        self.flush_latencies.append(time.perf_counter() - before)
+        logger.debug(f"Stored {depth} analytics messages for {len(pending)} users.")
+        return depth
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Gets the statistics of the queue.
+        """
+        sizes = np.asarray(self.flush_sizes)
+        latencies = np.asarray(self.flush_latencies) * 1000
+        return {
+            "depth": self.depth,
+            "flushes": self.flushes,
+            "stored": self.stored,
+            "dropped": self.dropped,
+            "mean_flush_size": float(sizes.mean()) if sizes.size else 0.0,
+            "p50_flush_ms": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+            "p99_flush_ms": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+        }
+
+    async def run(self):
+        """
+        Flushes the queue whenever a batch is full or the flush interval passes, forever.
+        """
+        while True:
+            await curio.ignore_after(self.flush_interval, self._full.wait())
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush analytics queue")
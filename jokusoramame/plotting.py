@@ -0,0 +1,268 @@
+"""
+Plot rendering.
+
+Plots are drawn with the object-oriented matplotlib API, without any pyplot global state, in a
+pool of worker processes, so that any number of them can render at once. Rendered plots are
+cached by a hash of what they were rendered from.
+"""
+import asyncio
+import datetime
+import hashlib
+import os
+import pickle
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+
+import curio
+import logbook
+import matplotlib.dates
+import matplotlib.style
+import numpy as np
+import seaborn as sns
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+
+from jokusoramame.cache import SizedLRU
+from jokusoramame.redis import RedisInterface
+from jokusoramame.utils import bridged
+
+logger = logbook.Logger("Jokusoramame.plotting")
+
+Colour = Tuple[float, float, float]
+
+
+class PlottingError(Exception):
+    """
+    Raised when a plot can't be rendered. The message is safe to show to users.
+    """
+
+
+def plot_key(func, args: tuple) -> str:
+    """
+    Gets the cache key of a plot; a hash of its render function (which decides its kind and
+    style) and everything passed to it.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"{func.__module__}.{func.__qualname__}".encode())
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            hasher.update(f"{arg.dtype}{arg.shape}".encode())
+            hasher.update(np.ascontiguousarray(arg).tobytes())
+        else:
+            hasher.update(pickle.dumps(arg, protocol=4))
+
+    return hasher.hexdigest()
+
+
+def _new_figure(**kwargs) -> Figure:
+    figure = Figure(**kwargs)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _to_png(figure: Figure) -> bytes:
+    buf = BytesIO()
+    figure.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_event_stats(names: List[str], values: List[int], colours: List[Colour]) -> bytes:
+    """
+    Renders a bar chart of the number of events handled.
+    """
+    figure = _new_figure()
+    axes = figure.add_subplot(1, 1, 1)
+
+    y_pos = np.arange(len(names))
+    axes.bar(y_pos, values, align='center', color=colours)
+    axes.set_xticks(y_pos)
+    axes.set_xticklabels(names, rotation=90)
+    axes.set_ylabel("Count")
+    axes.set_xlabel("Event")
+    axes.set_title("Event stats")
+    figure.tight_layout()
+
+    return _to_png(figure)
+
+
+def render_distribution(values: Sequence[float], label: str) -> bytes:
+    """
+    Renders a distribution curve of some values.
+    """
+    array = np.asarray(values)
+
+    figure = _new_figure()
+    axes = figure.add_subplot(1, 1, 1)
+    sns.distplot(array, bins=np.arange(array.min(), array.max()), kde=True, ax=axes)
+    axes.set_xlabel(label)
+    axes.set_ylabel("Count")
+    axes.set_xbound(0, np.max(array))
+    axes.set_title("Distribution curve")
+    figure.tight_layout()
+    sns.despine(fig=figure, ax=axes)
+
+    return _to_png(figure)
+
+
+def render_activity(counts: np.ndarray, start: float, title: str) -> bytes:
+    """
+    Renders the number of messages sent per hour.
+
+    :param counts: The number of messages sent in each hour, oldest first.
+    :param start: The UTC timestamp of the first hour.
+    """
+    first = datetime.datetime.utcfromtimestamp(start)
+    hours = [first + datetime.timedelta(hours=i) for i in range(len(counts))]
+
+    figure = _new_figure(figsize=(10, 4))
+    axes = figure.add_subplot(1, 1, 1)
+    axes.fill_between(hours, counts, step="post", alpha=0.4)
+    axes.step(hours, counts, where="post")
+    axes.xaxis.set_major_formatter(matplotlib.dates.DateFormatter("%d %b %H:%M"))
+    axes.set_xlim(hours[0], hours[-1] + datetime.timedelta(hours=1))
+    axes.set_ylim(bottom=0)
+    axes.set_xlabel("Time (UTC)")
+    axes.set_ylabel("Messages per hour")
+    axes.set_title(title)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    return _to_png(figure)
+
+
+def render_palette(colours: List[Colour], dark: bool = False) -> bytes:
+    """
+    Renders a palette as a row of squares, like ``seaborn.palplot``.
+    """
+    count = len(colours)
+    # the bot's seaborn style, with the dark background over it if asked for
+    with sns.axes_style("whitegrid"), \
+            matplotlib.style.context("dark_background" if dark else {}):
+        figure = _new_figure(figsize=(count, 1))
+        axes = figure.add_subplot(1, 1, 1)
+        axes.imshow(np.arange(count).reshape(1, count), cmap=ListedColormap(list(colours)),
+                    interpolation="nearest", aspect="auto")
+        axes.set_xticks(np.arange(count) - .5)
+        axes.set_yticks([-.5, .5])
+        axes.set_xticklabels([])
+        axes.set_yticklabels([])
+        figure.tight_layout()  # remove useless padding
+
+        return _to_png(figure)
+
+
+class PlotService(object):
+    """
+    Renders plots in a pool of worker processes.
+
+    At most ``workers`` plots render at once, and at most ``max_queued`` more wait for a worker;
+    any more are rejected rather than queued indefinitely.
+
+    Rendered plots are kept in a byte-bounded LRU, and optionally in Redis to share them between
+    processes. Cached plots are returned without touching a worker at all.
+    """
+
+    def __init__(self, workers: int = None, max_queued: int = 16, timeout: float = 30,
+                 cache_size: int = 64 * 1024 ** 2, redis: Optional[RedisInterface] = None,
+                 redis_ttl: int = 3600):
+        """
+        :param workers: The number of worker processes. Defaults to the number of cores.
+        :param max_queued: The maximum number of plots waiting for a worker.
+        :param timeout: The number of seconds a single plot may take to render.
+        :param cache_size: The maximum number of bytes of plots to cache in this process.
+        :param redis: The :class:`.RedisInterface` to also cache plots in, if any.
+        :param redis_ttl: The number of seconds plots are cached in Redis for.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.timeout = timeout
+
+        #: plot key -> PNG bytes.
+        self.cache = SizedLRU(cache_size)
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._slots = curio.BoundedSemaphore(self.workers)
+
+        #: The number of plots rendering or waiting to.
+        self.pending = 0
+
+    @bridged
+    async def _wait(self, future: Future, timeout: Optional[float]) -> bytes:
+        # shielded, so that timing out leaves the job alone
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+    async def _release_when_done(self, future: Future):
+        """
+        Holds a worker slot until a job that was given up on finishes, so that new jobs can't
+        pile up in the executor behind it.
+        """
+        try:
+            await self._wait(future, None)
+        except Exception:
+            pass
+        finally:
+            await self._slots.release()
+
+    async def render(self, func, *args) -> bytes:
+        """
+        Renders a plot in a worker process, or gets it from the cache.
+
+        :param func: The module-level render function to call, such as
+            :func:`.render_distribution`.
+        :param args: The arguments to call it with; these must be picklable.
+        :return: The rendered plot, as PNG bytes.
+        """
+        key = plot_key(func, args)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        if self.redis is not None:
+            data = await self.redis.get_plot(key)
+            if data is not None:
+                self.cache.set(key, data, len(data))
+                return data
+
+        data = await self._render(func, *args)
+        self.cache.set(key, data, len(data))
+        if self.redis is not None:
+            await self.redis.set_plot(key, data, self.redis_ttl)
+
+        return data
+
+    async def _render(self, func, *args) -> bytes:
+        if self.pending >= self.workers + self.max_queued:
+            raise PlottingError("Too many plots are being rendered right now, try again later.")
+
+        self.pending += 1
+        try:
+            await self._slots.acquire()
+            try:
+                future = self._executor.submit(func, *args)
+            except Exception:
+                await self._slots.release()
+                raise
+
+            try:
+                return await self._wait(future, self.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Rendering {func.__name__} timed out.")
+                raise PlottingError("This plot took too long to render.")
+            finally:
+                # a running worker can't be stopped, so its slot is kept until it finishes
+                if future.done() or future.cancel():
+                    await self._slots.release()
+                else:
+                    await curio.spawn(self._release_when_done, future, daemon=True)
+        finally:
+            self.pending -= 1
+
+    def close(self):
+        """
+        Shuts down the worker processes.
+        """
+        self._executor.shutdown(wait=False)
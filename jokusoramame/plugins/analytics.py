@@ -3,31 +3,33 @@ Analytical work.
 """
 import base64
 import datetime
-import entropy
+import hashlib
 import random
-import string
-from io import BytesIO
-from typing import Awaitable, Dict, Tuple
+from typing import Any, Dict, Hashable, List, Optional, Tuple
 
-import asks
 import curio
-import matplotlib.pyplot as plt
+import logbook
 import numpy as np
-import seaborn as sns
 import tabulate
 from asks.response_objects import Response
 from clarifai.rest import ApiError, ClarifaiApp
-from curio.thread import AWAIT, async_thread
-from curious import Embed, EventContext, Guild, Member, Message, event
+from curious import Attachment, Channel, Embed, EventContext, Guild, Member, Message, event
 from curious.commands import Context, Plugin
 from curious.commands.decorators import autoplugin, ratelimit
 from curious.commands.ratelimit import BucketNamer
 from curious.ext.paginator import ReactionsPaginator
-from matplotlib.axes import Axes
+from lru import LRU
 
 from jokusoramame import USER_AGENT
+from jokusoramame.cache import SizedLRU
+from jokusoramame.plotting import render_activity, render_distribution
+from jokusoramame.redis import ACTIVITY_DAYS
+from jokusoramame.textstats import StatsTable, byte_entropy, byte_histogram, \
+    histogram_entropy
 from jokusoramame.utils import get_apikeys
 
+logger = logbook.Logger("Jokusoramame.analytics")
+
 
 @autoplugin
 class Analytics(Plugin):
@@ -69,9 +71,26 @@ class Analytics(Plugin):
         self.clarifai = ClarifaiApp(api_key=clarifai_keys.key)
         ClarifaiApp.check_upgrade = old_cu
 
+        config = client.config.get("analytics", {})
+        #: (guild_id, sort key or None) -> (message watermark, result) for guild-wide results.
+        self._results = SizedLRU(config.get("result_cache_bytes", 32 * 1024 ** 2),
+                                 ttl=config.get("result_cache_ttl", 600))
+        #: The number of new messages in a guild after which its cached results are recomputed.
+        self._results_stale_after = config.get("result_cache_stale_messages", 500)
+
+        #: The maximum number of bytes of an attachment to read for its entropy.
+        self._entropy_max_bytes = config.get("entropy_max_bytes", 8 * 1024 ** 2)
+
+        #: The largest attachment that is downloaded to key its prediction by content.
+        self._imagetag_max_bytes = config.get("imagetag_max_bytes", 8 * 1024 ** 2)
+        #: Image content hash (or URL) -> Clarifai prediction.
+        self._image_tags = LRU(config.get("imagetag_cache_size", 4096))
+        #: Bounds the number of threads blocked on the synchronous Clarifai client.
+        self._clarifai_slots = curio.BoundedSemaphore(config.get("clarifai_threads", 4))
+
     @event("message_create")
     async def add_to_analytics(self, ctx: EventContext, message: Message):
-        await ctx.bot.redis.add_message(message)
+        await ctx.bot.analytics_queue.add(message)
 
     async def make_commentanalyzer_request(self, model: str, message: str):
         """
@@ -93,7 +112,8 @@ class Analytics(Plugin):
             }
         }
         params = {"key": self.perspective.key}
-        response: Response = await asks.post(uri=url, json=body, params=params)
+        response: Response = await self.client.http_sessions.post(url, json=body,
+                                                                  params=params)
 
         return response
 
@@ -102,7 +122,10 @@ class Analytics(Plugin):
         Analyses the toxicity of a message. Warning: Google will store these messages for analysis.
         """
         async with ctx.channel.typing:
-            response = await self.make_commentanalyzer_request("TOXICITY", message)
+            response = await ctx.bot.api_cache.get(
+                "toxicity", message,
+                lambda: self.make_commentanalyzer_request("TOXICITY", message)
+            )
 
         if response.status_code != 200:
             return await ctx.channel.messages.send(f":x: API returned error: {response.content}")
@@ -140,7 +163,11 @@ class Analytics(Plugin):
         body = {"text": message, "mode": "tweet"}
 
         async with ctx.channel.typing:
-            response: Response = await asks.post(uri=url, data=body, headers=self.aylien_headers)
+            response: Response = await ctx.bot.api_cache.get(
+                "sentiment", message,
+                lambda: self.client.http_sessions.post(url, data=body,
+                                                       headers=self.aylien_headers)
+            )
 
         if response.status_code != 200:
             return await ctx.channel.messages.send(f":x: API returned error: {response.text}")
@@ -175,8 +202,11 @@ class Analytics(Plugin):
         body = {"phrase": phrase}
 
         async with ctx.channel.typing:
-            response: Response = await asks.post(uri=url, data=body,
-                                                 headers=self.aylien_headers)
+            response: Response = await ctx.bot.api_cache.get(
+                "thesaurus", phrase,
+                lambda: self.client.http_sessions.post(url, data=body,
+                                                       headers=self.aylien_headers)
+            )
 
         if response.status_code != 200:
             return await ctx.channel.messages.send(f":x: API returned error: {response.text}")
@@ -207,9 +237,9 @@ class Analytics(Plugin):
         params = {
             "version": "2017-10-13"
         }
-        response: Response = await asks.post(uri=url, json=body,
-                                             params=params,
-                                             headers=self.watson_headers)
+        response: Response = await self.client.http_sessions.post(url, json=body,
+                                                                  params=params,
+                                                                  headers=self.watson_headers)
 
         return response
 
@@ -283,57 +313,139 @@ class Analytics(Plugin):
                                        respond_to=ctx.author)
         await paginator.paginate()
 
-    @async_thread()
-    def command_imagetag(self, ctx: Context, *, url: str = None):
+    async def predict_image(self, content: bytes = None, url: str = None) -> dict:
+        """
+        Gets the Clarifai concepts for an image, from the cache where possible.
+
+        :param content: The content of the image, if it has been downloaded.
+        :param url: The URL of the image, used when there is no content.
+        :return: A dict of ``concepts`` (the top 10 name/value pairs) and ``model``.
+        """
+        if content is not None:
+            key = "sha256:" + hashlib.sha256(content).hexdigest()
+        else:
+            key = "url:" + url
+
+        cached = self._image_tags.get(key)
+        if cached is not None:
+            return cached
+
+        def predict():
+            model = self.clarifai.models.get("general-v1.3")
+            if content is not None:
+                return model.predict_by_bytes(content)
+
+            return model.predict_by_url(url)
+
+        async with self._clarifai_slots:
+            result = await curio.run_in_thread(predict)
+
+        output = result['outputs'][0]
+        prediction = {
+            "concepts": [(concept['name'], concept['value'])
+                         for concept in output['data']['concepts'][:10]],
+            "model": output['model']['name']
+        }
+        self._image_tags[key] = prediction
+        return prediction
+
+    async def download_attachment(self, attachment: Attachment,
+                                  max_bytes: int) -> Optional[bytes]:
+        """
+        Downloads an attachment, unless it is bigger than ``max_bytes``.
+
+        :return: The content of the attachment, or None if it is too big or couldn't be
+            downloaded.
+        """
+        if attachment.size > max_bytes:
+            return None
+
+        # the size is whatever Discord says it is, so stream the body and stop at the limit anyway
+        chunks, read = [], 0
+        try:
+            r: Response = await self.client.http_sessions.get(attachment.proxy_url, stream=True)
+            if r.status_code != 200:
+                return None
+
+            async with r.body:
+                async for chunk in r.body:
+                    read += len(chunk)
+                    if read > max_bytes:
+                        return None
+
+                    chunks.append(chunk)
+        except Exception:
+            logger.exception(f"Failed to download attachment {attachment.proxy_url}")
+            return None
+
+        return b"".join(chunks)
+
+    async def command_imagetag(self, ctx: Context, *, url: str = None):
         """
         Gets information about an image.
         """
+        content = None
         if url is None:
             try:
                 attachment = ctx.message.attachments[0]
             except IndexError:
-                return AWAIT(ctx.channel.messages.send(":x: Could not find any file to tag."))
+                return await ctx.channel.messages.send(":x: Could not find any file to tag.")
             url = attachment.proxy_url
 
-        model = self.clarifai.models.get("general-v1.3")
+            # reposts of the same image have different URLs, so key them by their content,
+            # falling back to the URL if the image can't be downloaded
+            content = await self.download_attachment(attachment, self._imagetag_max_bytes)
+
         try:
-            result = model.predict_by_url(url)
+            async with ctx.channel.typing:
+                prediction = await self.predict_image(content=content, url=url)
         except ApiError as e:
-            return AWAIT(ctx.channel.messages.send(f":x: API error: {e.error_desc}"))
-
-        data = result['outputs'][0]['data']
+            return await ctx.channel.messages.send(f":x: API error: {e.error_desc}")
 
         em = Embed()
         em.title = "Image Tag Results"
         em.set_thumbnail(url=url)
         em.description = "Top 10 concepts (name/probability):"
 
-        for concept in data['concepts'][:10]:
-            em.add_field(name=concept['name'], value=f"{concept['value'] * 100:.2f}%")
+        for name, value in prediction['concepts']:
+            em.add_field(name=name, value=f"{value * 100:.2f}%")
 
-        em.set_footer(text=f"Using model {result['outputs'][0]['model']['name']}")
+        em.set_footer(text=f"Using model {prediction['model']}")
         em.colour = random.randint(0x000000, 0xffffff)
         em.timestamp = datetime.datetime.utcnow()
-        AWAIT(ctx.channel.messages.send(embed=em))
+        await ctx.channel.messages.send(embed=em)
 
     async def command_entropy(self, ctx: Context, *, message: str = None):
         """
         Gets the entropy of a sentence.
         """
-        if message is None:
-            # assume a file
-            try:
-                f = ctx.message.attachments[0]
-            except IndexError:
-                return await ctx.channel.send(":x: You must provide a message or attach a file.")
+        if message is not None:
+            en = byte_entropy(message.encode('utf-8', errors='ignore'))
+            return await ctx.channel.messages.send(f"Entropy: {en}")
 
-            async with ctx.channel.typing:
-                r: Response = await asks.get(f.url)
-            message = r.content
-        else:
-            message = message.encode('utf-8', errors='ignore')
+        # assume a file
+        try:
+            f = ctx.message.attachments[0]
+        except IndexError:
+            return await ctx.channel.send(":x: You must provide a message or attach a file.")
+
+        # stream the file into a histogram, so only one chunk is ever held in memory
+        histogram = np.zeros(256, dtype=np.int64)
+        read = 0
+        async with ctx.channel.typing:
+            r: Response = await ctx.bot.http_sessions.get(f.url, stream=True)
+            async with r.body:
+                async for chunk in r.body:
+                    chunk = chunk[:self._entropy_max_bytes - read]
+                    histogram += byte_histogram(chunk)
+                    read += len(chunk)
+                    if read >= self._entropy_max_bytes:
+                        break
+
+        en = histogram_entropy(histogram)
+        if read >= self._entropy_max_bytes:
+            return await ctx.channel.messages.send(f"Entropy: {en} (of the first {read} bytes)")
 
-        en = entropy.shannon_entropy(message)
         await ctx.channel.messages.send(f"Entropy: {en}")
 
     async def command_analyse(self, ctx: Context):
@@ -354,7 +466,15 @@ class Analytics(Plugin):
                 "message_create", predicate=lambda m: m.author == ctx.author
             )
         if result.content.lower() == "y":
-            await ctx.bot.redis.clear_member_data(ctx.author.user)
+            # anything still queued (such as the answer) would be stored again after the clear
+            user = ctx.author.user
+            await ctx.bot.analytics_queue.discard(user.id)
+            await ctx.bot.redis.clear_member_data(user)
+            if await ctx.bot.analytics_queue.discard(user.id):
+                # some were being stored as they were cleared
+                await ctx.bot.redis.clear_member_data(user)
+            # the user could be in any number of cached results
+            self._results.clear()
             return await ctx.channel.messages.send("Cleared.")
 
     async def command_analyse_toggle(self, ctx: Context, *, guild_id: int):
@@ -370,49 +490,33 @@ class Analytics(Plugin):
             return await ctx.channel.send(":x: This guild does not exist.")
 
         enabled = await ctx.bot.redis.toggle_analytics(guild)
+        self.invalidate_results(guild.id)
         await ctx.channel.messages.send(f":heavy_check_mark: Analytics status: {enabled}")
 
     async def analyse_member(self, member: Member) -> dict:
         """
         Analyses a member's messages, returning a dictionary of statistics.
         """
-        messages = await self.client.redis.get_messages(member.user)
-        if len(messages) == 0:
-            return {}
-
-        # do some processing
-        total_entropy = 0
-        total_length = 0
-
-        # count capitals vs lowercase
-        capitals = 0
+        stats = await self.client.redis.get_member_stats(member.user)
+        return self.summarise_stats(stats)
 
-        # track number of used messages
-        used_messages = 0
-
-        for message in messages:
-            content = message["c"]
-            if not content:
-                continue
-
-            used_messages += 1
-
-            total_entropy += entropy.shannon_entropy(content)
-            total_length += len(content)
-            capitals += sum(char in string.ascii_uppercase for char in content)
-
-        # calculate averages
-        avg_entropy = total_entropy / len(messages)
-        avg_message_length = sum(len(m["c"]) for m in messages) / len(messages)
+    @staticmethod
+    def summarise_stats(stats: Dict[str, float]) -> dict:
+        """
+        Turns a member's running statistics into a dictionary of analysis results.
+        """
+        if not stats or stats["total"] <= 0:
+            return {}
 
+        total = stats["total"]
         return {
-            "message_count": used_messages,
-            "message_total": len(messages),
-            "total_entropy": total_entropy,
-            "total_length": total_length,
-            "average_entropy": avg_entropy,
-            "average_length": avg_message_length,
-            "capitals": capitals
+            "message_count": int(stats["count"]),
+            "message_total": int(total),
+            "total_entropy": stats["entropy"],
+            "total_length": int(stats["length"]),
+            "average_entropy": stats["entropy"] / total,
+            "average_length": stats["length"] / total,
+            "capitals": int(stats["capitals"])
         }
 
     async def command_analyse_member(self, ctx: Context, *, victim: Member = None):
@@ -449,39 +553,112 @@ class Analytics(Plugin):
 
         await ctx.channel.messages.send(embed=em)
 
-    async def get_combined_member_data(self, guild: Guild) -> Dict[Member, dict]:
+    async def command_analyse_activity(self, ctx: Context, days: int = 7,
+                                       channel: Channel = None):
         """
-        Gets the combined member data for a guild.
+        Plots the number of messages sent per hour over the last few days.
         """
-        member_data = {member: await self.analyse_member(member)
-                       for member in guild.members.values() if not member.user.bot}
-        member_data = {member: data for (member, data) in member_data.items()
-                       if data}
+        days = max(1, min(days, ACTIVITY_DAYS))
+
+        async with ctx.channel.typing:
+            start, counts = await self.client.redis.get_activity(
+                ctx.guild.id, days, channel.id if channel is not None else None
+            )
+            if not counts.any():
+                return await ctx.channel.messages.send(":x: There is no activity recorded for "
+                                                       "this period.")
 
-        return member_data
+            name = f"#{channel.name}" if channel is not None else ctx.guild.name
+            data = await ctx.bot.plots.render(render_activity, counts, start,
+                                              f"Activity in {name} over the last {days} days")
+
+        await ctx.channel.messages.upload(data, filename="activity.png")
+
+    def get_cached_result(self, guild_id: int, key: Optional[Hashable]) -> Optional[Any]:
+        """
+        Gets a cached guild-wide result, if not too many messages have arrived since.
+        """
+        cached = self._results.get((guild_id, key))
+        if cached is None:
+            return None
+
+        watermark, result = cached
+        if self.client.analytics_queue.guild_counts[guild_id] - watermark \
+                >= self._results_stale_after:
+            self._results.pop((guild_id, key))
+            return None
+
+        return result
+
+    def cache_result(self, guild_id: int, key: Optional[Hashable], watermark: int,
+                     result: Any, size: int):
+        """
+        Caches a guild-wide result.
+
+        :param watermark: The guild's message count when the result started being computed.
+        :param size: The approximate size of the result, in bytes.
+        """
+        self._results.set((guild_id, key), (watermark, result), size)
+
+    def invalidate_results(self, guild_id: int):
+        """
+        Drops every cached result for a guild.
+        """
+        for key in self._results:
+            if key[0] == guild_id:
+                self._results.pop(key)
+
+    async def get_guild_stats(self, guild: Guild) -> StatsTable:
+        """
+        Gets the summarised statistics of every member of a guild with analytics data.
+        """
+        cached = self.get_cached_result(guild.id, None)
+        if cached is not None:
+            return cached
+
+        watermark = self.client.analytics_queue.guild_counts[guild.id]
+        members = [member for member in guild.members.values() if not member.user.bot]
+        stats = await self.client.redis.get_member_stats_bulk(member.user for member in members)
+        table = StatsTable.from_stats(stats)
+
+        self.cache_result(guild.id, None, watermark, table, table.nbytes)
+        return table
+
+    async def get_top_members(self, guild: Guild, sort_key: str = "average_entropy",
+                              count: int = 10, bottom: bool = False) -> List[Tuple[Member, dict]]:
+        """
+        Gets the members of a guild with the highest (or lowest) value of a statistic.
+
+        :param sort_key: The :data:`.StatsTable.COLUMNS` column to rank by.
+        :param count: The number of members to get.
+        :param bottom: If the members with the lowest values should be got instead.
+        :return: A list of (member, statistics), in rank order.
+        """
+        table = await self.get_guild_stats(guild)
+        # members who left since the table was built are skipped, so select a few extra
+        top = table.top(sort_key, count + 10, bottom=bottom)
+        members = [(guild.members.get(user_id), row) for (user_id, row) in top]
+        return [(member, row) for (member, row) in members if member is not None][:count]
 
     async def command_analyse_server(self, ctx: Context):
         """
         Analyses the current server.
         """
         async with ctx.channel.typing:
-            member_data = await self.get_combined_member_data(ctx.guild)
-
-        def sum_data(key: str) -> int:
-            return sum(x[key] for x in member_data.values())
+            table = await self.get_guild_stats(ctx.guild)
 
-        message_count = sum_data('message_count')
-        message_total = sum_data('message_total')
-        average_entropy = sum_data('average_entropy') / len(member_data)
-        average_length = sum_data('average_length') / len(member_data)
-        total_length = sum_data('total_length')
-        capitals = sum_data('capitals')
+        message_count = int(table.sum('message_count'))
+        message_total = int(table.sum('message_total'))
+        average_entropy = table.sum('average_entropy') / len(table)
+        average_length = table.sum('average_length') / len(table)
+        total_length = int(table.sum('total_length'))
+        capitals = table.sum('capitals')
 
         em = Embed()
         em.title = "GHCQ Analysis Department"
         em.description = f"Analysis for {ctx.guild.name} used {message_count} messages " \
                          f"({message_total - message_count} messages skipped) " \
-                         f"from {len(member_data)} members"
+                         f"from {len(table)} members"
         em.add_field(name="Avg. entropy",
                      value=format(average_entropy, '.4f'))
         em.add_field(name="Avg. message length",
@@ -494,16 +671,6 @@ class Analytics(Plugin):
 
         await ctx.channel.messages.send(embed=em)
 
-    async def get_sorted_items(self, guild: Guild, sort_key: str = "average_entropy"):
-        """
-        Gets a list of sorted member analytics data.
-        """
-        member_data = await self.get_combined_member_data(guild)
-        sorted_data = sorted(list(member_data.items()),
-                             key=lambda i: i[1][sort_key], reverse=True)
-
-        return sorted_data
-
     async def command_server_top(self, ctx: Context, *, sort_by: str = "entropy"):
         """
         Shows the top 10 people in the server by a field, where field is one of
@@ -516,9 +683,8 @@ class Analytics(Plugin):
         elif sort_by == "capitals":
             sort_key = "capitals"
 
-        # sort by key, get the top 10
         async with ctx.channel.typing:
-            member_data = (await self.get_sorted_items(ctx.guild, sort_key))[:10]
+            member_data = await self.get_top_members(ctx.guild, sort_key, 10)
 
         headers = ["POS", "Name", "Entropy", "Avg. Length", "Capitals"]
         rows = []
@@ -550,40 +716,9 @@ class Analytics(Plugin):
         elif item == "capitals":
             item_key = "capitals"
 
-        @async_thread()
-        def plotter(member_data) -> Awaitable[BytesIO]:
-            """
-            The main plotter function.
-            """
-            with ctx.bot._plot_lock:
-                array = np.asarray([m[item_key] for m in member_data.values()])
-
-                axes: Axes = sns.distplot(array, bins=np.arange(array.min(), array.max()),
-                                          kde=True)
-                axes.set_xlabel(item.capitalize())
-                axes.set_ylabel("Count")
-                axes.set_xbound(0, np.max(array))
-                plt.title("Distribution curve")
-                plt.tight_layout()
-                sns.despine()
-
-                # write to the main buffer
-                buf = BytesIO()
-                plt.savefig(buf, format='png')
-                buf.seek(0)
-
-                # cleanup after ourselves
-                plt.clf()
-                plt.cla()
-
-                return buf
-
         async with ctx.channel.typing:
-            fetched_data = await self.get_combined_member_data(ctx.guild)
-
-            if ctx.bot._plot_lock.locked():
-                await ctx.channel.send("Waiting for plot lock...")
-
-            buf = await plotter(fetched_data)  # wait for the plotter to lock and plot
+            table = await self.get_guild_stats(ctx.guild)
+            data = await ctx.bot.plots.render(render_distribution, table.columns[item_key],
+                                              item.capitalize())
 
-        await ctx.channel.messages.upload(buf.read(), filename="plot.png")
+        await ctx.channel.messages.upload(data, filename="plot.png")
@@ -7,22 +7,18 @@ import subprocess
 import sys
 import time
 import traceback
-from io import BytesIO, StringIO
+from io import StringIO
 from itertools import cycle
 
-import asks
 import asyncqlio
 import curio
 import curious
 import git
-import matplotlib.pyplot as plt
-import numpy as np
 import pkg_resources
 import psutil
 import tabulate
 from asks.response_objects import Response
 from curio.subprocess import run
-from curio.thread import spawn_thread
 from curious import Channel, Embed, EventContext, event
 from curious.commands import Plugin, command, condition
 from curious.commands.context import Context
@@ -31,6 +27,7 @@ from curious.commands.ratelimit import BucketNamer
 from curious.exc import HTTPException, PermissionsError
 
 from jokusoramame.bot import Jokusoramame
+from jokusoramame.plotting import render_event_stats
 from jokusoramame.utils import display_time, rgbize
 
 
@@ -183,8 +180,7 @@ class Core(Plugin):
         """
         Changes the name of the bot.
         """
-        sess = asks.Session()
-        resp: Response = await sess.get(link)
+        resp: Response = await ctx.bot.http_sessions.get(link)
         if resp.status_code != 200:
             await ctx.channel.messages.send(f":x: Failed to download avatar. "
                                             f"(code: {resp.status_code})")
@@ -239,10 +235,27 @@ class Core(Plugin):
         em.add_field(name="Servers", value=len(ctx.bot.guilds))
         em.add_field(name="Shards", value=ctx.event_context.shard_count)
 
+        queue = ctx.bot.analytics_queue.get_stats()
+        em.add_field(name="Analytics queue",
+                     value=f"{queue['depth']} queued, {queue['mean_flush_size']:.1f} per flush, "
+                           f"{queue['p99_flush_ms']:.1f} ms p99 flush")
+
         em.set_footer(text=f"香港快递 | Git branch: {curr_branch.name}")
 
         await ctx.channel.messages.send(embed=em)
 
+    @command()
+    @condition(is_owner)
+    async def httpstats(self, ctx: Context):
+        """
+        Shows how often outbound HTTP requests reused a connection, per host.
+        """
+        rows = [[location, stats["requests"], stats["connections"], stats["reused"]]
+                for (location, stats) in ctx.bot.http_sessions.get_stats().items()]
+        table = tabulate.tabulate(rows, headers=["Host", "Requests", "Connections", "Reused"],
+                                  tablefmt="orgtbl")
+        await ctx.channel.messages.send(f"```\n{table}```")
+
     @command()
     @ratelimit(limit=1, time=60, bucket_namer=BucketNamer.GLOBAL)
     async def stats(self, ctx: Context):
@@ -252,30 +265,16 @@ class Core(Plugin):
         palette = [0xabcdef, 0xbcdefa, 0xcdefab, 0xdefabc, 0xefabcd, 0xfabcde]
         palette = cycle(palette)
 
-        async with ctx.channel.typing, spawn_thread():
-            with ctx.bot._plot_lock:
-                names, values = [], []
-                for name, value in ctx.bot.events_handled.most_common():
-                    names.append(name)
-                    values.append(value)
-
-                colours = rgbize([next(palette) for _ in names])
-
-                y_pos = np.arange(len(names))
-                plt.bar(y_pos, values, align='center', color=colours)
-                plt.xticks(y_pos, names, rotation=90)
-                plt.ylabel("Count")
-                plt.xlabel("Event")
-                plt.tight_layout()
-                plt.title("Event stats")
-
-                buf = BytesIO()
-                plt.savefig(buf, format='png')
-                plt.cla()
-                plt.clf()
-
-        buf.seek(0)
-        data = buf.read()
+        names, values = [], []
+        for name, value in ctx.bot.events_handled.most_common():
+            names.append(name)
+            values.append(value)
+
+        colours = rgbize([next(palette) for _ in names])
+
+        async with ctx.channel.typing:
+            data = await ctx.bot.plots.render(render_event_stats, names, values, colours)
+
         await ctx.channel.messages.upload(data, filename="stats.png")
 
     @command()
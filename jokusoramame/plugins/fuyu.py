@@ -2,7 +2,6 @@ import logging
 import random
 import re
 
-import asks
 from asks.response_objects import Response
 from curious import EventContext, Message, event
 from curious.commands import Plugin
@@ -63,7 +62,7 @@ class Fuyu(Plugin):
 
         owner, repo, issue = match.groups()
         url = self.API_URL + f"/repos/{owner}/{repo}/issues/{issue}"
-        request: Response = await asks.get(headers=headers, uri=url)
+        request: Response = await self.client.http_sessions.get(url, headers=headers)
         if request.status_code == 429:  # rate-limit
             return
 
@@ -1,23 +1,44 @@
 """
 Plugin and utilities for levelling.
 """
+import math
 import random
-from typing import List
+import time
+from typing import Awaitable, Callable, Tuple
 
+import numpy as np
 import tabulate
 from asyncqlio import Session
 from curious import Embed, EventContext, Member, Message, event
 from curious.commands import Context, Plugin, command
 from curious.exc import Forbidden, PermissionsError
 from curious.ext.paginator import ReactionsPaginator
-from numpy.ma import floor
-from numpy.polynomial import Polynomial as P
+from lru import LRU
 
 from jokusoramame.db.tables import UserXP
+from jokusoramame.ranking import GuildRankings, LeaderboardPages, RedisRankings
 
 INCREASING_FACTOR = 75
 
 
+def _isqrt(n: int) -> int:
+    """
+    Integer square root, for Pythons without :func:`math.isqrt`.
+    """
+    if n < 2:
+        return n
+
+    x = 1 << ((n.bit_length() + 1) // 2)
+    while True:
+        y = (x + n // x) // 2
+        if y >= x:
+            return x
+        x = y
+
+
+isqrt = getattr(math, "isqrt", _isqrt)
+
+
 def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
     """
     Gets the level from the experience number.
@@ -32,16 +53,11 @@ def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
         # Level 1
         return 1
 
-    # The equation that we need to solve is (a/2)n**2 + (a/2)n - xp = 0.
-    # So we get numpy to find our roots.
-    ab = a / 2
-    # C, B, A
-    to_solve = [-xp, ab, ab]
-    poly = P(to_solve)
-
-    # Positive root + 1
-    root = poly.roots()[1] + 1
-    return int(floor(root))
+    # We want the largest n with a * n(n+1)/2 <= xp, i.e. n(n+1) <= m where m = floor(2xp / a).
+    # Completing the square gives (2n + 1)**2 <= 4m + 1, which is exact in integers.
+    m = int(2 * xp // a)
+    n = (isqrt(4 * m + 1) - 1) // 2
+    return n + 1
 
 
 def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR):
@@ -52,25 +68,133 @@ def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR):
     :param xp: The XP this user currently has.
     :return: The current level, and the amount of XP required for the next level.
     """
-    # No complxes
-    if xp < a:
-        return 1, a - xp
-
-    # Solve the current level.
     current_level = get_level_from_exp(xp, a)
 
-    # Substitute in (n+1) to a* (n*(n+1)  / 2), where n == current_level
-    # or not idk
-    exp_required = int(a * (current_level * (current_level + 1) / 2))
+    # Substitute n == current_level into a * (n*(n+1) / 2), the total XP for the next level.
+    exp_required = a * current_level * (current_level + 1) // 2
 
     return current_level, exp_required - xp
 
 
+def get_levels_from_exp_array(xp: np.ndarray, a: int = INCREASING_FACTOR) -> np.ndarray:
+    """
+    Gets the levels for an array of experience numbers in one pass.
+
+    :param xp: An array of XP values.
+    :param a: The levelling up constant.
+    :return: An int64 array of levels, the same shape as ``xp``.
+    """
+    m = np.maximum((2 * np.asarray(xp, dtype=np.int64)) // a, 0)
+    n = ((np.sqrt(4 * m + 1) - 1) // 2).astype(np.int64)
+
+    # the float sqrt can be off by one for big values, so nudge n onto the exact answer
+    n -= n * (n + 1) > m
+    n += (n + 1) * (n + 2) <= m
+    return n + 1
+
+
+def get_next_exp_required_array(xp: np.ndarray, a: int = INCREASING_FACTOR) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gets the current levels and the XP required for the next level for an array of XP values.
+
+    :param xp: An array of XP values.
+    :param a: The levelling up constant.
+    :return: The current levels, and the amount of XP required for the next level.
+    """
+    xp = np.asarray(xp, dtype=np.int64)
+    levels = get_levels_from_exp_array(xp, a)
+    return levels, a * levels * (levels + 1) // 2 - xp
+
+
+class LazyReactionsPaginator(ReactionsPaginator):
+    """
+    A :class:`.ReactionsPaginator` that only renders pages when they are first shown.
+    """
+
+    def __init__(self, render: Callable[[int], Awaitable[str]], page_count: int, **kwargs):
+        """
+        :param render: A coroutine function that renders a page from its number.
+        :param page_count: The total number of pages.
+        """
+        super().__init__(content=[None] * page_count, **kwargs)
+        self._render = render
+
+    async def send_current_page(self):
+        if self._message_chunks[self.page] is None:
+            self._message_chunks[self.page] = await self._render(self.page)
+
+        return await super().send_current_page()
+
+
 class Levelling(Plugin):
     """
     Plugin for levelling.
     """
 
+    def __init__(self, client):
+        super().__init__(client)
+
+        levelling = client.config.get("levelling", {})
+
+        #: The per-guild XP rankings.
+        if levelling.get("ranking_backend", "memory") == "redis":
+            self.rankings = RedisRankings(client.db, client.xp_buffer, client.redis,
+                                          levelling.get("reconcile_interval", 3600))
+        else:
+            self.rankings = GuildRankings(client.db, client.xp_buffer)
+
+        #: The number of seconds a user has to wait between earning XP.
+        self.cooldown = levelling.get("cooldown", 60)
+        #: Where cooldowns are stored, either "memory" or "redis".
+        self.cooldown_backend = levelling.get("cooldown_backend", "memory")
+        #: (guild_id, user_id) -> when the user's cooldown ends, for the memory backend.
+        self._cooldowns = LRU(levelling.get("cooldown_cache_size", 100_000))
+
+    async def load(self):
+        if isinstance(self.rankings, RedisRankings):
+            return await self.spawn(self.rankings.run)
+
+    async def start_cooldown(self, guild_id: int, user_id: int) -> bool:
+        """
+        Starts the XP cooldown for a user.
+
+        :return: False if the user is already on cooldown, True otherwise.
+        """
+        if self.cooldown <= 0:
+            return True
+
+        if self.cooldown_backend == "redis":
+            return await self.client.redis.start_xp_cooldown(guild_id, user_id, self.cooldown)
+
+        key = (guild_id, user_id)
+        now = time.monotonic()
+        if self._cooldowns.get(key, 0) > now:
+            return False
+
+        self._cooldowns[key] = now + self.cooldown
+        return True
+
+    async def get_xp(self, ctx: Context, member: Member) -> int:
+        """
+        Gets the current XP of a member, preferring the buffered value.
+        """
+        buffered = ctx.bot.xp_buffer.peek(member.guild_id, member.id)
+        if buffered is not None:
+            return buffered[0]
+
+        ranked = await self.rankings.get_xp(member.guild_id, member.id)
+        if ranked is not None:
+            return ranked
+
+        sess: Session = ctx.bot.db.get_session()
+        async with sess:
+            row: UserXP = await sess.select.from_(UserXP) \
+                .where((UserXP.user_id == member.id) & (UserXP.guild_id == member.guild_id))\
+                .first()
+
+        return row.xp if row is not None else 0
+
     @event("message_create")
     async def update_levels(self, ctx: EventContext, message: Message):
         """
@@ -84,71 +208,51 @@ class Levelling(Plugin):
         if message.author.user.bot:
             return
 
-        # TODO: Handle anti-spam.
         # first, get the amount of XP we're gonna add
         xp_add = random.randint(0, 4)
         if xp_add == 0:
             return
 
-        sess: Session = ctx.bot.db.get_session()
-        async with sess:
-            # TODO: Move this into the database.
-            users = await sess.select(UserXP) \
-                .where(UserXP.guild_id.eq(message.guild_id)) \
-                .order_by(UserXP.xp.desc()) \
-                .all()
-            users: List[UserXP] = await users.flatten()
-
-            index, user = next(
-                filter(lambda tup: tup[1].user_id == message.author_id, enumerate(users)),
-                (None, None)
-            )
-
-            if user is None:
-                user = UserXP()
-                user.guild_id = message.guild_id
-                user.user_id = message.author_id
-                user.level = 1
-                user.xp = 0
-
-            # add on the xp
-            user.xp += xp_add
-            # check if the user can level up
-            next_level = get_level_from_exp(user.xp)
+        # anti-spam
+        if not await self.start_cooldown(message.guild_id, message.author_id):
+            return
+
+        xp, level = await ctx.bot.xp_buffer.add(message.guild_id, message.author_id, xp_add)
+        await self.rankings.record(message.guild_id, message.author_id, xp, xp_add)
+
+        # check if the user can level up
+        next_level = get_level_from_exp(xp)
+        if next_level <= level:
+            return
+
+        ctx.bot.xp_buffer.set_level(message.guild_id, message.author_id, next_level)
+
+        # only rank the user when we actually have something to show
+        position, total = await self.rankings.get_rank_of_xp(message.guild_id, xp)
+
+        # make the embed to send
+        em = Embed()
+        em.title = "Level up!"
+        em.description = f":tada: **{message.author.user.username} is now level " \
+                         f"{next_level}!** Current XP: {xp} XP"
+        em.set_thumbnail(url=message.author.user.static_avatar_url)
+        em.colour = message.author.colour
+        # calculate required xp
+        level, required = get_next_exp_required(xp)
+        em.add_field(name=f"Required for level {level + 1}", value=f"{required} XP")
+        em.add_field(name="Ranking", value=f"{position} / {total}")
+
+        try:
+            await message.channel.messages.send(embed=em)
+        except (PermissionsError, Forbidden):
+            # no embeds
             try:
-                if next_level > user.level:
-                    user.level = next_level
-
-                    # make the embed to send
-                    em = Embed()
-                    em.title = "Level up!"
-                    em.description = f":tada: **{message.author.user.username} is now level " \
-                                     f"{user.level}!** Current XP: {user.xp} XP"
-                    em.set_thumbnail(url=message.author.user.static_avatar_url)
-                    em.colour = message.author.colour
-                    # calculatte required xp
-                    level, required = get_next_exp_required(user.xp)
-                    em.add_field(name=f"Required for level {level + 1}", value=f"{required} XP")
-                    em.add_field(name="Ranking",
-                                 value=f"{index + 1 if index is not None else '???'} "
-                                       f"/ {len(users)}")
-                    # get ranking
-                    # ranking, total = await ctx.bot.db.get_userxp_ranking(message.author)
-                    # em.add_field(name="Ranking", value=f"{ranking} / {total}")
-
-                    try:
-                        await message.channel.messages.send(embed=em)
-                    except (PermissionsError, Forbidden):
-                        # no embeds
-                        try:
-                            await message.channel.messages.send(f":tada: "
-                                                                f"**{message.author.user.username} "
-                                                                f"is now level {user.level}**!")
-                        except (PermissionsError, Forbidden):
-                            # oh well
-                            pass
-            finally:
-                await sess.add(user)
+                await message.channel.messages.send(f":tada: "
+                                                    f"**{message.author.user.username} "
+                                                    f"is now level {next_level}**!")
+            except (PermissionsError, Forbidden):
+                # oh well
+                pass
 
     @command()
     async def level(self, ctx: Context, *, member=None):
@@ -163,29 +267,21 @@ class Levelling(Plugin):
             member = ctx._lookup_converter(Member)(Member, ctx, member)
         member = member or ctx.author
 
-        sess: Session = ctx.bot.db.get_session()
-        async with sess:
-            # TODO: Move this into the database.
-            users = await sess.select(UserXP) \
-                .where(UserXP.guild_id.eq(member.guild_id)) \
-                .order_by(UserXP.xp.desc()) \
-                .all()
-
-            users: List[UserXP] = await users.flatten()
-
-            filtered = filter(lambda tup: tup[1].user_id == member.id, enumerate(users))
-            index, user = next(filtered, (None, None))
-
-        if user is None:
+        ranking = await self.rankings.get_rank(member.guild_id, member.id)
+        if ranking is None:
             await ctx.channel.send(f"{member.mention} has no level data.")
             return
 
+        position, total, xp = ranking
+
+        level, required = get_next_exp_required(xp)
+
         em = Embed()
         em.title = str(member.nickname)
-        em.add_field(name="Level", value=user.level, inline=True)
-        em.add_field(name="XP", value=user.xp)
-        em.add_field(name="XP required for next level", value=get_next_exp_required(user.xp)[1])
-        em.add_field(name="Ranking", value=f"{index + 1} / {len(users)}")
+        em.add_field(name="Level", value=level, inline=True)
+        em.add_field(name="XP", value=xp)
+        em.add_field(name="XP required for next level", value=required)
+        em.add_field(name="Ranking", value=f"{position} / {total}")
         em.colour = member.colour
         em.thumbnail.url = member.user.static_avatar_url
         await ctx.channel.send(embed=em)
@@ -195,45 +291,36 @@ class Levelling(Plugin):
         """
         Shows the current leaderboard for levels.
         """
-        sess: Session = ctx.bot.db.get_session()
-        async with sess:
-            query = sess.select(UserXP).where(UserXP.guild_id.eq(ctx.guild.id))
-            print(ctx.tokens, ctx.command_name)
-            if len(ctx.tokens) >= 1 and ctx.tokens[0] == "bottom":
-                query = query.order_by(UserXP.xp.asc())
-            else:
-                query = query.order_by(UserXP.xp.desc())
-            rows = await query.all()
-            rows: List[UserXP] = await rows.flatten()
-
-        # paginate into chunks
-        chunks = [rows[i:i + 10] for i in range(0, len(rows), 10)]
-        messages = []
-        position = 0
-        for chunk in chunks:
-            rows = []
+        bottom = mode == "bottom" or (len(ctx.tokens) >= 1 and ctx.tokens[0] == "bottom")
+        pages = LeaderboardPages(ctx.bot.db, ctx.guild.id, descending=not bottom,
+                                 rankings=self.rankings)
+        page_count = await pages.count()
 
-            for row in chunk:
-                position += 1
-                member = ctx.guild.members.get(row.user_id)
-                name = member.user.name if member is not None else str(row.user_id)
+        async def render(page: int) -> str:
+            rows = []
+            for position, user_id, xp in await pages.get(page):
+                member = ctx.guild.members.get(user_id)
+                name = member.user.name if member is not None else str(user_id)
                 # no unicode tyvm
                 name = name.encode("ascii", errors="replace").decode("ascii", errors="replace")
-                rows.append((str(position), name, row.xp, row.level))
+                rows.append((str(position), name, xp, get_level_from_exp(xp)))
 
             tbl = tabulate.tabulate(rows, headers=["POS", "User", "XP", "Level"],
                                     tablefmt="orgtbl")
+            return f"```\n{tbl}```"
 
-            messages.append(f"```\n{tbl}```")
+        if page_count == 0:
+            return await ctx.channel.send(":x: Nobody in this server has any level data.")
 
-        if len(messages) == 1:
-            return await ctx.channel.send(messages[0])
+        if page_count == 1:
+            return await ctx.channel.send(await render(0))
 
         if not ctx.channel.me_permissions.add_reactions:
-            for message in messages:
-                await ctx.channel.messages.send(message)
+            for page in range(page_count):
+                await ctx.channel.messages.send(await render(page))
         else:
-            paginator = ReactionsPaginator(content=messages, channel=ctx.channel, respond_to=ctx.author)
+            paginator = LazyReactionsPaginator(render, page_count, channel=ctx.channel,
+                                               respond_to=ctx.author)
             await paginator.paginate()
 
     @level.subcommand(name="next")
@@ -244,13 +331,7 @@ class Levelling(Plugin):
         if target is None:
             target = ctx.author
 
-        sess: Session = ctx.bot.db.get_session()
-        async with sess:
-            row: UserXP = await sess.select.from_(UserXP) \
-                .where((UserXP.user_id == target.id) & (UserXP.guild_id == target.guild_id))\
-                .first()
-
-        xp = row.xp if row is not None else 0
+        xp = await self.get_xp(ctx, target)
         _, xp_required = get_next_exp_required(xp)
         await ctx.channel.send(f"**{target.user.username}** needs `{xp_required}` XP to advance "
                                f"to level `{_ + 1}`.")
@@ -263,15 +344,5 @@ class Levelling(Plugin):
         if target is None:
             target = ctx.author
 
-        sess: Session = ctx.bot.db.get_session()
-        async with sess:
-            row: UserXP = await sess.select.from_(UserXP) \
-                .where((UserXP.user_id == target.id) & (UserXP.guild_id == target.guild_id))\
-                .first()
-
-        if row is None:
-            xp = 0
-        else:
-            xp = row.xp
-
+        xp = await self.get_xp(ctx, target)
         await ctx.channel.send(f"User **{target.user.username}** has `{xp}` XP.")
\ No newline at end of file
@@ -3,7 +3,6 @@ import random
 import re
 from typing import Tuple
 
-import asks
 import googlemaps
 from asks.response_objects import Response
 from curio.thread import async_thread
@@ -88,12 +87,8 @@ class Location(Plugin):
             "app_key": self.transportkey.key,
             **params
         }
-        headers = {
-            "User-Agent": USER_AGENT
-        }
-
         uri = self.URL_PREFIX + route
-        result = await asks.get(uri=uri, params=params, headers=headers)
+        result = await self.client.http_sessions.get(uri, params=params)
         return result
 
     async def get_atco(self, location: str) -> dict:
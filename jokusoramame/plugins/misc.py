@@ -1,15 +1,12 @@
 import re
-from io import BytesIO
-from typing import Awaitable, List
+from typing import List
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-from curio.thread import async_thread
 from curious.commands import Context, Plugin
 from curious.commands.decorators import autoplugin, ratelimit
 from yapf.yapflib.style import CreatePEP8Style
 from yapf.yapflib.yapf_api import FormatCode
 
+from jokusoramame.plotting import render_palette
 from jokusoramame.utils import rgbize
 
 code_regexp = re.compile(r"```([^\n]+)\n?(.+)\n?```", re.DOTALL)
@@ -24,46 +21,12 @@ class Misc(Plugin):
         """
         pal_colours = rgbize(colours[:12])
 
-        @async_thread
-        def plot_palette() -> Awaitable[BytesIO]:
-            with ctx.bot._plot_lock:
-                sns.palplot(pal_colours, size=1)
-                plt.tight_layout()  # remove useless padding
-
-                buf = BytesIO()
-                plt.savefig(buf, format="png")
-                buf.seek(0)
-
-                plt.clf()
-                plt.cla()
-
-                return buf
-
-        @async_thread()
-        def plot_dark_palette() -> Awaitable[BytesIO]:
-            with ctx.bot._plot_lock:
-                with plt.style.context("dark_background"):
-                    sns.palplot(pal_colours, size=1)
-                    plt.tight_layout()  # remove useless padding
-
-                    buf = BytesIO()
-                    plt.savefig(buf, format="png")
-                    buf.seek(0)
-
-                    plt.clf()
-                    plt.cla()
-
-                return buf
-
-        if ctx.bot._plot_lock.locked():
-            await ctx.channel.messages.send("Waiting for plot lock...")
-
         async with ctx.channel.typing:
-            buf = await plot_palette()
-            buf2 = await plot_dark_palette()
+            data = await ctx.bot.plots.render(render_palette, pal_colours)
+            data_dark = await ctx.bot.plots.render(render_palette, pal_colours, True)
 
-        await ctx.channel.messages.upload(fp=buf.read(), filename="plot.png")
-        await ctx.channel.messages.upload(fp=buf2, filename="plot_dark.png")
+        await ctx.channel.messages.upload(fp=data, filename="plot.png")
+        await ctx.channel.messages.upload(fp=data_dark, filename="plot_dark.png")
 
     def _normalize_language(self, lang: str) -> str:
         """
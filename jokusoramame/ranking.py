@@ -0,0 +1,492 @@
+"""
+XP rankings, held either in memory or in Redis.
+"""
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import curio
+import logbook
+from asyncqlio import DatabaseInterface, Session
+from lru import LRU
+
+from jokusoramame.redis import RedisInterface
+from jokusoramame.xpbuffer import XPBuffer
+
+logger = logbook.Logger("Jokusoramame.ranking")
+
+#: Loads every ranked user in a guild.
+WARM_SQL = """
+SELECT user_id, xp FROM user_xp WHERE guild_id = {guild_id};
+"""
+
+#: Counts the ranked users in a guild.
+COUNT_SQL = """
+SELECT COUNT(*) AS total FROM user_xp WHERE guild_id = {guild_id};
+"""
+
+
+class RankIndex(object):
+    """
+    A sorted index of the XP of every ranked user in a guild.
+
+    Lookups are a binary search over a sorted list of ``(-xp, user_id)`` keys.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, int]] = ()):
+        """
+        :param rows: An iterable of (user_id, xp) pairs to start with.
+        """
+        #: user_id -> xp
+        self._xp: Dict[int, int] = dict(rows)
+
+        #: The sorted (-xp, user_id) keys, i.e. highest XP first.
+        self._keys = sorted((-xp, user_id) for (user_id, xp) in self._xp.items())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._xp
+
+    def get(self, user_id: int) -> Optional[int]:
+        """
+        Gets the XP of a user, or None if they are not ranked.
+        """
+        return self._xp.get(user_id)
+
+    def update(self, user_id: int, xp: int):
+        """
+        Sets the XP of a user, moving them to their new position.
+        """
+        old = self._xp.get(user_id)
+        if old == xp:
+            return
+
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+
+        insort(self._keys, (-xp, user_id))
+        self._xp[user_id] = xp
+
+    def rank_of_xp(self, xp: int) -> int:
+        """
+        Gets the position an XP value would be ranked at.
+        """
+        # (-xp,) sorts before every (-xp, user_id), so this counts everyone with more XP
+        return bisect_left(self._keys, (-xp,)) + 1
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """
+        Gets the position of a user, or None if they are not ranked.
+        """
+        xp = self._xp.get(user_id)
+        if xp is None:
+            return None
+
+        return self.rank_of_xp(xp)
+
+    def between(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """
+        Gets the (user_id, xp) pairs of the users at positions ``[start, stop)``, zero-indexed.
+        """
+        return [(user_id, -xp) for (xp, user_id) in self._keys[start:stop]]
+
+
+class GuildRankings(object):
+    """
+    Lazily loaded :class:`.RankIndex` objects for guilds.
+    """
+
+    def __init__(self, db: DatabaseInterface, xp_buffer: XPBuffer, max_guilds: int = 256):
+        """
+        :param db: The :class:`.DatabaseInterface` to warm indexes from.
+        :param xp_buffer: The :class:`.XPBuffer` holding XP not yet in the database.
+        :param max_guilds: The maximum number of guilds to keep indexes for.
+        """
+        self.db = db
+        self.xp_buffer = xp_buffer
+
+        #: guild_id -> RankIndex
+        self._indexes = LRU(max_guilds)
+
+        #: guild_id -> lock held whilst warming that guild
+        self._locks: Dict[int, curio.Lock] = {}
+
+    def peek(self, guild_id: int) -> Optional[RankIndex]:
+        """
+        Gets the index for a guild, if it is warm.
+        """
+        return self._indexes.get(guild_id)
+
+    async def get(self, guild_id: int) -> RankIndex:
+        """
+        Gets the index for a guild, loading it from the database if needed.
+        """
+        index = self._indexes.get(guild_id)
+        if index is not None:
+            return index
+
+        lock = self._locks.setdefault(guild_id, curio.Lock())
+        async with lock:
+            # somebody else might have warmed it whilst we waited
+            index = self._indexes.get(guild_id)
+            if index is not None:
+                return index
+
+            sess: Session = self.db.get_session()
+            async with sess:
+                cursor = await sess.cursor(WARM_SQL, {"guild_id": guild_id})
+                rows = await cursor.flatten()
+
+            index = RankIndex((row["user_id"], row["xp"]) for row in rows)
+            # overlay anything that hasn't been flushed yet
+            for user_id, xp in self.xp_buffer.guild_totals(guild_id):
+                index.update(user_id, xp)
+
+            self._indexes[guild_id] = index
+
+        self._locks.pop(guild_id, None)
+        return index
+
+    def update(self, guild_id: int, user_id: int, xp: int):
+        """
+        Updates the XP of a user, if their guild's index is warm.
+        """
+        index = self._indexes.get(guild_id)
+        if index is not None:
+            index.update(user_id, xp)
+
+    async def record(self, guild_id: int, user_id: int, xp: int, amount: int):
+        """
+        Records that a user has gained XP.
+
+        :param xp: The new total XP of the user.
+        :param amount: The amount of XP that was gained.
+        """
+        self.update(guild_id, user_id, xp)
+
+    async def get_xp(self, guild_id: int, user_id: int) -> Optional[int]:
+        """
+        Gets the XP of a user, or None if it isn't known without asking the database.
+        """
+        index = self.peek(guild_id)
+        if index is None:
+            return None
+
+        return index.get(user_id) or 0
+
+    async def get_rank(self, guild_id: int, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """
+        Gets the ranking of a user.
+
+        :return: A (position, total, xp) tuple, or None if the user isn't ranked.
+        """
+        index = await self.get(guild_id)
+        xp = index.get(user_id)
+        if xp is None:
+            return None
+
+        return index.rank_of_xp(xp), len(index), xp
+
+    async def get_rank_of_xp(self, guild_id: int, xp: int) -> Tuple[int, int]:
+        """
+        Gets the position an XP value would be ranked at.
+
+        :return: A (position, total) tuple.
+        """
+        index = await self.get(guild_id)
+        return index.rank_of_xp(xp), len(index)
+
+    async def get_count(self, guild_id: int) -> int:
+        """
+        Gets the number of ranked users in a guild, warming its index if needed so that later
+        counts and pages come straight from memory.
+        """
+        index = await self.get(guild_id)
+        return len(index)
+
+    async def get_range(self, guild_id: int, start: int, stop: int,
+                        descending: bool = True) -> Optional[List[Tuple[int, int]]]:
+        """
+        Gets the (user_id, xp) pairs at positions ``[start, stop)``, or None if the guild isn't
+        warm.
+        """
+        index = self.peek(guild_id)
+        if index is None:
+            return None
+
+        if descending:
+            return index.between(start, stop)
+
+        end = len(index) - start
+        return index.between(max(len(index) - stop, 0), end)[::-1]
+
+
+class RedisRankings(object):
+    """
+    XP rankings mirrored into a sorted set per guild in Redis.
+
+    The sorted sets are built from the database on first use, updated as XP is gained, and
+    rebuilt every ``reconcile_interval`` seconds so they can't drift from the database.
+
+    XP gained is recorded as the user's new total rather than an increment, and waits for any
+    rebuild of the guild in progress in this process, so it can't be lost to or counted twice by
+    a rebuild.
+    """
+
+    def __init__(self, db: DatabaseInterface, xp_buffer: XPBuffer, redis: RedisInterface,
+                 reconcile_interval: float = 3600):
+        """
+        :param db: The :class:`.DatabaseInterface` to rebuild sorted sets from.
+        :param xp_buffer: The :class:`.XPBuffer` holding XP not yet in the database.
+        :param redis: The :class:`.RedisInterface` to store sorted sets in.
+        :param reconcile_interval: The number of seconds between rebuilds.
+        """
+        self.db = db
+        self.xp_buffer = xp_buffer
+        self.redis = redis
+        self.reconcile_interval = reconcile_interval
+
+        #: guild_id -> lock held whilst rebuilding that guild
+        self._locks: Dict[int, curio.Lock] = {}
+
+        #: guild_id -> event set once the rebuild of that guild in progress has finished
+        self._rebuilding: Dict[int, curio.Event] = {}
+
+    async def _rebuild(self, guild_id: int):
+        done = self._rebuilding[guild_id] = curio.Event()
+        try:
+            sess: Session = self.db.get_session()
+            async with sess:
+                cursor = await sess.cursor(WARM_SQL, {"guild_id": guild_id})
+                rows = await cursor.flatten()
+
+            scores = {row["user_id"]: row["xp"] for row in rows}
+            # overlay anything that hasn't been flushed yet
+            scores.update(self.xp_buffer.guild_totals(guild_id))
+            # empty guilds are rebuilt once this runs out, in case users were added another way
+            await self.redis.rebuild_xp_ranking(guild_id, scores, int(self.reconcile_interval))
+        finally:
+            if self._rebuilding.get(guild_id) is done:
+                del self._rebuilding[guild_id]
+            await done.set()
+
+    async def rebuild(self, guild_id: int):
+        """
+        Rebuilds the sorted set for a guild from the database.
+        """
+        lock = self._locks.setdefault(guild_id, curio.Lock())
+        async with lock:
+            await self._rebuild(guild_id)
+
+        self._locks.pop(guild_id, None)
+
+    async def _ensure(self, guild_id: int):
+        """
+        Ensures the sorted set for a guild has been built.
+        """
+        if await self.redis.has_xp_ranking(guild_id):
+            return
+
+        lock = self._locks.setdefault(guild_id, curio.Lock())
+        async with lock:
+            # somebody else might have built it whilst we waited
+            if not await self.redis.has_xp_ranking(guild_id):
+                await self._rebuild(guild_id)
+
+        self._locks.pop(guild_id, None)
+
+    async def record(self, guild_id: int, user_id: int, xp: int, amount: int):
+        """
+        Records that a user has gained XP.
+
+        :param xp: The new total XP of the user.
+        :param amount: The amount of XP that was gained.
+        """
+        rebuilding = self._rebuilding.get(guild_id)
+        if rebuilding is not None:
+            # the rebuild's snapshot might not have this, and would overwrite it
+            await rebuilding.wait()
+
+        # unbuilt sets are left alone by the script, so this can't race a first build either
+        await self.redis.set_xp(guild_id, user_id, xp)
+
+    async def get_xp(self, guild_id: int, user_id: int) -> Optional[int]:
+        """
+        Gets the XP of a user, or None if it isn't known without asking the database.
+        """
+        return await self.redis.get_xp(guild_id, user_id)
+
+    async def get_rank(self, guild_id: int, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """
+        Gets the ranking of a user.
+
+        :return: A (position, total, xp) tuple, or None if the user isn't ranked.
+        """
+        await self._ensure(guild_id)
+        return await self.redis.get_xp_rank(guild_id, user_id)
+
+    async def get_rank_of_xp(self, guild_id: int, xp: int) -> Tuple[int, int]:
+        """
+        Gets the position an XP value would be ranked at.
+
+        :return: A (position, total) tuple.
+        """
+        await self._ensure(guild_id)
+        return await self.redis.get_xp_rank_of_score(guild_id, xp)
+
+    async def get_count(self, guild_id: int) -> Optional[int]:
+        """
+        Gets the number of ranked users in a guild.
+        """
+        await self._ensure(guild_id)
+        return await self.redis.get_xp_count(guild_id)
+
+    async def get_range(self, guild_id: int, start: int, stop: int,
+                        descending: bool = True) -> Optional[List[Tuple[int, int]]]:
+        """
+        Gets the (user_id, xp) pairs at positions ``[start, stop)``.
+        """
+        await self._ensure(guild_id)
+        return await self.redis.get_xp_range(guild_id, start, stop, descending=descending)
+
+    async def reconcile(self):
+        """
+        Rebuilds every sorted set from the database.
+        """
+        for guild_id in await self.redis.get_xp_ranking_guilds():
+            await self.rebuild(guild_id)
+
+    async def run(self):
+        """
+        Reconciles the sorted sets every ``reconcile_interval`` seconds, forever.
+        """
+        while True:
+            await curio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Failed to reconcile XP rankings")
+
+
+class LeaderboardPages(object):
+    """
+    Lazily fetched pages of a guild's XP leaderboard.
+
+    Pages are loaded from the guild's rankings if they are available, and otherwise from the
+    database using keyset pagination off of whichever neighbouring page has already been loaded.
+    """
+
+    def __init__(self, db: DatabaseInterface, guild_id: int, *, descending: bool = True,
+                 rankings=None, page_size: int = 10):
+        """
+        :param db: The :class:`.DatabaseInterface` to load pages from.
+        :param guild_id: The guild ID to load the leaderboard of.
+        :param descending: If the leaderboard should start with the highest XP.
+        :param rankings: The :class:`.GuildRankings` or :class:`.RedisRankings` to try first.
+        :param page_size: The number of users per page.
+        """
+        self.db = db
+        self.guild_id = guild_id
+        self.descending = descending
+        self.rankings = rankings
+        self.page_size = page_size
+
+        #: The total number of ranked users.
+        self.total: Optional[int] = None
+
+        #: page -> [(id, user_id, xp)]
+        self._pages: Dict[int, List[Tuple[int, int, int]]] = {}
+
+    async def count(self) -> int:
+        """
+        Gets the number of pages in this leaderboard.
+        """
+        if self.total is None and self.rankings is not None:
+            self.total = await self.rankings.get_count(self.guild_id)
+
+        if self.total is None:
+            sess: Session = self.db.get_session()
+            async with sess:
+                row = await sess.fetch(COUNT_SQL, {"guild_id": self.guild_id})
+            self.total = row["total"]
+
+        return -(-self.total // self.page_size)
+
+    def _make_query(self, descending: bool, keyset: bool = False, offset: bool = False) -> str:
+        """
+        Makes the SQL for fetching a page in the specified direction.
+        """
+        direction = "DESC" if descending else "ASC"
+        sql = "SELECT id, user_id, xp FROM user_xp WHERE guild_id = {guild_id}"
+        if keyset:
+            sql += f" AND (xp, id) {'<' if descending else '>'} ({{xp}}, {{id}})"
+
+        sql += f" ORDER BY xp {direction}, id {direction} LIMIT {{limit}}"
+        if offset:
+            sql += " OFFSET {offset}"
+
+        return sql
+
+    async def _fetch(self, page: int) -> List[Tuple[int, int, int]]:
+        """
+        Fetches a page from the database.
+        """
+        params = {"guild_id": self.guild_id, "limit": self.page_size}
+        reverse = from_end = False
+
+        if page == 0:
+            sql = self._make_query(self.descending)
+        elif page - 1 in self._pages:
+            # the common case, paging forward
+            params["id"], _, params["xp"] = self._pages[page - 1][-1]
+            sql = self._make_query(self.descending, keyset=True)
+        elif page + 1 in self._pages:
+            # paging backwards, from the last page
+            params["id"], _, params["xp"] = self._pages[page + 1][0]
+            sql = self._make_query(not self.descending, keyset=True)
+            reverse = True
+        elif page == await self.count() - 1:
+            # the end of the leaderboard, read backwards; trimmed to the last page below
+            sql = self._make_query(not self.descending)
+            reverse = from_end = True
+        else:
+            params["offset"] = page * self.page_size
+            sql = self._make_query(self.descending, offset=True)
+
+        sess: Session = self.db.get_session()
+        async with sess:
+            cursor = await sess.cursor(sql, params)
+            rows = [(row["id"], row["user_id"], row["xp"]) for row in await cursor.flatten()]
+
+        if reverse:
+            rows.reverse()
+
+        if from_end:
+            # the last page holds whatever is left over, which may be less than a whole page
+            remainder = self.total - page * self.page_size
+            if 0 < remainder < len(rows):
+                rows = rows[len(rows) - remainder:]
+
+        return rows
+
+    async def get(self, page: int) -> List[Tuple[int, int, int]]:
+        """
+        Gets a page of the leaderboard.
+
+        :param page: The zero-indexed page number.
+        :return: A list of (position, user_id, xp) tuples.
+        """
+        start = page * self.page_size
+
+        if self.rankings is not None:
+            rows = await self.rankings.get_range(self.guild_id, start, start + self.page_size,
+                                                 descending=self.descending)
+            if rows is not None:
+                return [(start + i + 1, user_id, xp) for i, (user_id, xp) in enumerate(rows)]
+
+        if page not in self._pages:
+            self._pages[page] = await self._fetch(page)
+
+        return [(start + i + 1, user_id, xp)
+                for i, (_, user_id, xp) in enumerate(self._pages[page])]
@@ -0,0 +1,116 @@
+"""
+The compact binary record format that analytics messages are stored in.
+
+A record is a fixed header followed by the message content::
+
+    +---------+--------------------+-----------------+---------------------+
+    | 1 byte  | 8 bytes            | 8 bytes         | n bytes             |
+    | version | timestamp (ms, BE) | channel ID (BE) | content             |
+    | + flags |                    |                 |                     |
+    +---------+--------------------+-----------------+---------------------+
+
+The low nibble of the first byte is the format version, and the high nibble holds flags. The
+content is UTF-8, raw-deflated against :data:`ZDICT` unless that wouldn't make it smaller, in
+which case it is stored as-is.
+
+Records written before this format existed are zlib-compressed JSON, and always start with a
+zlib header byte (``0x78``), which no version of this format can start with.
+"""
+import json
+import struct
+import zlib
+
+#: The current record format version.
+RECORD_VERSION = 1
+
+#: Set in the flags when the content is deflated.
+FLAG_COMPRESSED = 0x10
+
+#: The record header; version and flags, the timestamp in milliseconds, and the channel ID.
+HEADER = struct.Struct(">BQQ")
+
+#: The first byte of a legacy zlib-compressed JSON record.
+LEGACY_MARKER = 0x78
+
+#: Content shorter than this is never worth deflating.
+MIN_COMPRESS_LENGTH = 8
+
+# The shared deflate dictionary, for version 1 records. Deflate prefers matches nearer the end
+# of the dictionary, so the most common fragments come last.
+# This must never change without bumping RECORD_VERSION, or old records will decode wrongly.
+_ZDICT_FRAGMENTS = (
+    "https://www.youtube.com/watch?v= https://twitter.com/ https://i.imgur.com/ .png .jpg .gif "
+    "https://cdn.discordapp.com/attachments/ https://discord.gg/ https://",
+    "<:thonk: <:blobsweat: <a: :joy: :thinking: :eyes: :ok_hand: ```py\n``` ``` **",
+    " because something anything everything nothing someone people really actually probably "
+    "though thought through should would could about after again think thing going doing "
+    "being would've I'm I've I'll I'd don't doesn't didn't can't won't isn't wasn't that's "
+    "what's there's it's he's she's they're you're we're let's",
+    " please thanks thank you sorry maybe never always still already every other right "
+    "good great nice cool time today tomorrow yesterday night morning game play server "
+    "channel message bot discord",
+    " lmao lmfao lol xd haha hahaha omg wtf idk imo tbh ngl brb gg rip pls plz yeah yep nah "
+    "nope ok okay oh hmm wait what why how who when where which",
+    " the and that this with have from they will your what just like know want when there "
+    "then than them were been more some time here into only also well very much make can "
+    "not but for are was you all get one out now see new any how its our use had has him "
+    "his her she who did say way may too",
+    " <@!<@<#<@& I a an the to of in is it on at be do go no so up me my we if or as by he ",
+)
+
+#: The shared deflate dictionary for version 1 records.
+ZDICT = "".join(_ZDICT_FRAGMENTS).encode()
+
+# A decompressor primed with the dictionary; copying it is cheaper than priming a new one.
+_DECOMPRESSOR = zlib.decompressobj(wbits=-zlib.MAX_WBITS, zdict=ZDICT)
+
+
+def _deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS, memLevel=9, zdict=ZDICT)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _inflate(data: bytes) -> bytes:
+    decompressor = _DECOMPRESSOR.copy()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def encode_record(content: str, timestamp: float, channel_id: int) -> bytes:
+    """
+    Encodes a message as a record.
+
+    :param content: The content of the message.
+    :param timestamp: The UNIX timestamp the message was created at.
+    :param channel_id: The ID of the channel the message was sent in.
+    """
+    body = content.encode()
+    flags = 0
+    if len(body) >= MIN_COMPRESS_LENGTH:
+        deflated = _deflate(body)
+        if len(deflated) < len(body):
+            body = deflated
+            flags |= FLAG_COMPRESSED
+
+    header = HEADER.pack(RECORD_VERSION | flags, int(round(timestamp * 1000)), channel_id)
+    return header + body
+
+
+def decode_record(raw: bytes) -> dict:
+    """
+    Decodes a record, in either this format or the legacy JSON one.
+
+    :return: A dict of ``c`` (content), ``dt`` (timestamp) and ``ch`` (channel ID).
+    """
+    if raw[0] == LEGACY_MARKER:
+        return json.loads(zlib.decompress(raw).decode())
+
+    marker, timestamp, channel_id = HEADER.unpack_from(raw)
+    version = marker & 0x0f
+    if version != RECORD_VERSION:
+        raise ValueError(f"Unknown message record version {version}")
+
+    body = raw[HEADER.size:]
+    if marker & FLAG_COMPRESSED:
+        body = _inflate(body)
+
+    return {"c": body.decode(), "dt": timestamp / 1000, "ch": channel_id}
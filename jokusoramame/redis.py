@@ -1,82 +1,662 @@
 """
 Redis interface.
 """
-import json
-import zlib
+import asyncio
+import datetime
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 
-import redis
-from curio.thread import async_thread
+import curio
+import logbook
+import numpy as np
+import redis.asyncio as aioredis
+from curio.workers import run_in_process
 from curious import Guild, Message, User
+from lru import LRU
+
+from jokusoramame.records import decode_record, encode_record
+from jokusoramame.textstats import STAT_FIELDS, batch_stats, total_stats
+from jokusoramame.utils import bridged, chunked
+
+logger = logbook.Logger("Jokusoramame.redis")
+
+#: The pub/sub channel that analytics flag keys are published on when they change.
+FLAG_INVALIDATION_CHANNEL = "analytics_flag_invalidations"
+
+#: The maximum number of messages stored per user.
+MAX_MESSAGES = 5000
+
+#: The number of users to fetch per pipeline when fetching in bulk.
+BULK_CHUNK_SIZE = 500
+
+#: The number of users to decode per worker process job.
+DECODE_CHUNK_SIZE = 50
+
+#: The number of days hourly activity buckets are kept for.
+ACTIVITY_DAYS = 31
+
+#: Sets the score of a member of a sorted set, but only if the set has already been built;
+#: either it exists, or the marker for it being built empty (KEYS[2]) does.
+SET_IF_BUILT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 or redis.call('DEL', KEYS[2]) == 1 then
+    return redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+end
+return false
+"""
+
+
+def activity_bucket(guild_id: int, channel_id: int, timestamp: float) -> Tuple[str, str]:
+    """
+    Gets the hourly activity bucket of a message.
+
+    Buckets are fields of a hash per guild per (UTC) day, named ``{channel_id}:{hour}``.
+
+    :return: A (key, field) tuple.
+    """
+    created = datetime.datetime.utcfromtimestamp(timestamp)
+    return f"activity_{guild_id}_{created:%Y%m%d}", f"{channel_id}:{created.hour}"
+
+
+def decode_message(raw: bytes) -> dict:
+    """
+    Decodes a stored message, in any record format.
+    """
+    return decode_record(raw)
+
+
+def _decode_messages_bulk(raw_lists: List[List[bytes]]) -> List[List[dict]]:
+    """
+    Decodes several lists of stored messages. Ran in a worker process.
+    """
+    return [[decode_message(raw) for raw in raw_list] for raw_list in raw_lists]
+
+
+def _stats_bulk(raw_lists: List[List[bytes]]) -> List[Dict[str, float]]:
+    """
+    Computes the statistics of several lists of stored messages. Ran in a worker process.
+    """
+    return [total_stats([decode_message(raw)["c"] for raw in raw_list])
+            for raw_list in raw_lists]
+
+
+async def _map_in_processes(func, raw: Dict[int, List[bytes]]) -> dict:
+    """
+    Maps a bulk function over user_id -> raw messages in chunks, in worker processes.
+    """
+    user_ids = list(raw.keys())
+    results = {}
+
+    async def run_chunk(chunk: List[int]):
+        values = await run_in_process(func, [raw[user_id] for user_id in chunk])
+        results.update(zip(chunk, values))
+
+    async with curio.TaskGroup() as group:
+        for chunk in chunked(user_ids, DECODE_CHUNK_SIZE):
+            await group.spawn(run_chunk, chunk)
+
+    return results
 
 
 class RedisInterface(object):
     """
     Represents an interface to the Redis server.
+
+    Commands are sent with the asyncio redis client on the bridge loop, over a bounded
+    connection pool, so no thread is needed per call.
     """
 
-    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: str = None):
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: str = None,
+                 pool_size: int = 16, pool_timeout: float = 10, flag_cache_size: int = 100_000,
+                 flag_cache_ttl: float = 300):
+        """
+        :param host: The host to connect to redis on.
+        :param port: The port to connect to redis on.
+        :param password: The password to authenticate with, if any.
+        :param pool_size: The maximum number of open connections.
+        :param pool_timeout: How long (in seconds) to wait for a free connection.
+        :param flag_cache_size: The maximum number of analytics flags to cache.
+        :param flag_cache_ttl: How long (in seconds) a cached analytics flag is trusted for.
+        """
+        #: The connection pool. Callers wait for a free connection once it is exhausted.
+        self.pool = aioredis.BlockingConnectionPool(host=host, port=port, password=password,
+                                                    max_connections=pool_size,
+                                                    timeout=pool_timeout)
+        self.redis = aioredis.Redis(connection_pool=self.pool)
+        self._set_if_built = self.redis.register_script(SET_IF_BUILT_SCRIPT)
+
+        #: The analytics flag cache, of key -> (is set, expiry time).
+        #: Invalidated over pub/sub by :meth:`.listen_invalidations`, with the TTL as a fallback.
+        self._flags = LRU(flag_cache_size)
+        self._flag_ttl = flag_cache_ttl
+        #: Bumped on every invalidation, so that fetches racing one aren't cached.
+        self._flag_generation = 0
+
+    @bridged
+    async def close(self):
         """
-        :param redis_conn: A (host, port) tuple to connect to redis on.
+        Closes every connection in the pool.
         """
-        self.redis = redis.Redis(host=host, port=port, password=password)
+        await self.pool.disconnect()
 
-    @async_thread
-    def toggle_analytics(self, guild: Guild):
+    @bridged
+    async def toggle_analytics(self, guild: Guild):
         """
         Toggles analytics.
         """
         key = f"analytics_enabled_{guild.id}"
-        if self.redis.get(key):
-            self.redis.delete(key)
-            return False
+        try:
+            if await self.redis.get(key):
+                await self.redis.delete(key)
+                return False
 
-        self.redis.set(key, "\x07")
-        return True
+            await self.redis.set(key, "\x07")
+            return True
+        finally:
+            await self._publish_invalidation(key)
 
-    @async_thread
-    def clear_member_data(self, user: User):
+    @bridged
+    async def clear_member_data(self, user: User):
         """
         Clears the analytics data for a user.
         """
-        self.redis.set(f"analytics_flag_{user.id}", "true")
-        self.redis.delete(f"messages_{user.id}")
+        key = f"analytics_flag_{user.id}"
+        async with self.redis.pipeline() as pipeline:
+            pipeline.set(key, "true")
+            pipeline.delete(f"messages_{user.id}", f"analytics_stats_{user.id}")
+            pipeline.publish(FLAG_INVALIDATION_CHANNEL, key)
+            await pipeline.execute()
+
+        self._invalidate_flag(key)
+
+    def _invalidate_flag(self, key: Optional[str]):
+        """
+        Drops an analytics flag from the cache, or every flag if the key is None.
+        """
+        self._flag_generation += 1
+        if key is None:
+            self._flags.clear()
+            return
+
+        try:
+            del self._flags[key]
+        except KeyError:
+            pass
 
-    @async_thread
-    def add_message(self, message: Message):
+    async def _publish_invalidation(self, key: str):
+        """
+        Invalidates an analytics flag in this process, and in every other one.
+        """
+        self._invalidate_flag(key)
+        await self.redis.publish(FLAG_INVALIDATION_CHANNEL, key)
+
+    @bridged
+    async def listen_invalidations(self):
+        """
+        Listens for analytics flag invalidations forever. Spawned once the bot is ready.
+        """
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(FLAG_INVALIDATION_CHANNEL)
+                    # anything could have changed while we weren't subscribed
+                    self._invalidate_flag(None)
+
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._invalidate_flag(message["data"].decode())
+            except (aioredis.ConnectionError, aioredis.TimeoutError):
+                logger.exception("Lost the flag invalidation subscription, resubscribing")
+                self._invalidate_flag(None)
+                await asyncio.sleep(5)
+
+    @bridged
+    async def _fetch_flags(self, keys: List[str]) -> List[bool]:
+        """
+        Fetches if analytics flags are set, and caches them.
+        """
+        generation = self._flag_generation
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.exists(key)
+            values = [bool(value) for value in await pipeline.execute()]
+
+        if generation == self._flag_generation:
+            expiry = time.monotonic() + self._flag_ttl
+            for key, value in zip(keys, values):
+                self._flags[key] = (value, expiry)
+
+        return values
+
+    def _get_cached_flag(self, key: str) -> Optional[bool]:
+        """
+        Gets if an analytics flag is set from the cache, or None if it isn't cached.
+        """
+        cached = self._flags.get(key)
+        if cached is None or cached[1] < time.monotonic():
+            return None
+
+        return cached[0]
+
+    async def get_analytics_flags(self, guild_id: int, user_id: int) -> Tuple[bool, bool]:
+        """
+        Gets the analytics flags for a message, from the cache where possible.
+
+        :return: A (guild has analytics enabled, user has opted out) tuple.
+        """
+        keys = [f"analytics_enabled_{guild_id}", f"analytics_flag_{user_id}"]
+        enabled = self._get_cached_flag(keys[0])
+        # disabled guilds are the common case, so don't check the user at all
+        if enabled is False:
+            return False, False
+
+        opted_out = self._get_cached_flag(keys[1])
+        if enabled is None or opted_out is None:
+            enabled, opted_out = await self._fetch_flags(keys)
+
+        return enabled, opted_out
+
+    async def _rebuild_stats(self, user_id: int) -> Dict[str, float]:
+        """
+        Rebuilds the running statistics for a user from their stored messages.
+        """
+        key = f"messages_{user_id}"
+        stats_key = f"analytics_stats_{user_id}"
+
+        async def rebuild(pipe: aioredis.client.Pipeline):
+            raw = await pipe.lrange(key, 0, MAX_MESSAGES)
+            # decoding thousands of messages would stall the bridge loop
+            stats = await asyncio.get_event_loop().run_in_executor(
+                None, _stats_bulk, [raw]
+            )
+            pipe.multi()
+            pipe.delete(stats_key)
+            if raw:
+                pipe.hset(stats_key, mapping=stats[0])
+
+            return stats[0] if raw else {}
+
+        return await self.redis.transaction(rebuild, key, value_from_callable=True)
+
+    async def add_message(self, message: Message):
         """
         Adds a message to Redis, for usage in analysis.
 
         :param message: The :class:`.Message` to add.
         """
-
-        enabled = self.redis.get(f"analytics_enabled_{message.guild_id}")
-        if enabled is None:
+        enabled, opted_out = await self.get_analytics_flags(message.guild_id,
+                                                            message.author.user.id)
+        if not enabled or opted_out:
             return
 
-        allowed = self.redis.get(f"analytics_flag_{message.author.user.id}")
-        if allowed is not None:
-            return
+        timestamp = message.created_at.timestamp()
+        record = encode_record(message.content, timestamp, message.channel_id)
+        bucket = activity_bucket(message.guild_id, message.channel_id, timestamp)
+        await self.store_messages({message.author_id: [(record, message.content)]}, {bucket: 1})
+
+    @bridged
+    async def store_messages(self, messages: Dict[int, List[Tuple[bytes, str]]],
+                             activity: Dict[Tuple[str, str], int] = None):
+        """
+        Stores a batch of messages in a single pipeline, and updates the running statistics of
+        their authors. Each user's list is pushed to and trimmed once, however many messages
+        they have in the batch.
+
+        This only raises if the messages weren't stored. Once they are, fixing up the statistics
+        is best-effort; statistics that can't be fixed up are dropped, to be rebuilt from the
+        stored messages when next needed.
+
+        :param messages: A dict of user_id -> list of (record, content), oldest first.
+        :param activity: A dict of :func:`.activity_bucket` -> number of messages to count.
+        """
+        user_ids = list(messages.keys())
+        counts = [len(messages[user_id]) for user_id in user_ids]
+        stats = batch_stats([content for user_id in user_ids
+                             for (_, content) in messages[user_id]])
+        # sum the per-message statistics into per-user ones
+        starts = np.cumsum([0] + counts[:-1])
+        sums = {field: np.add.reduceat(values, starts) for (field, values) in stats.items()}
+
+        async with self.redis.pipeline() as pipeline:
+            for i, user_id in enumerate(user_ids):
+                key = f"messages_{user_id}"
+                stats_key = f"analytics_stats_{user_id}"
+                pipeline.exists(stats_key)
+                pipeline.lpush(key, *[record for (record, _) in messages[user_id]])
+                pipeline.lrange(key, MAX_MESSAGES + 1, -1)
+                pipeline.ltrim(key, 0, MAX_MESSAGES)
+                for field in STAT_FIELDS:
+                    pipeline.hincrbyfloat(stats_key, field, float(sums[field][i]))
+
+            # the activity commands go after the messages, so the results above line up
+            activity = activity or {}
+            for (key, field), count in activity.items():
+                pipeline.hincrby(key, field, count)
+            for key in {key for (key, _) in activity}:
+                pipeline.expire(key, ACTIVITY_DAYS * 86400)
+            # a failed command doesn't roll the others back, so don't raise for one either
+            results = await pipeline.execute(raise_on_error=False)
+
+        # the messages are stored now, so nothing below may raise, or they'd be stored twice
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logger.error(f"{len(errors)} commands failed storing analytics messages, "
+                         f"the first with: {errors[0]}")
+
+        per_user = 4 + len(STAT_FIELDS)
+        rebuild, removed = [], {}
+        for i, user_id in enumerate(user_ids):
+            user_results = results[i * per_user:(i + 1) * per_user]
+            has_stats, _, evicted = user_results[:3]
+            if not has_stats or any(isinstance(result, Exception) for result in user_results):
+                # the stats have never been built, or may be wrong, so build them from the
+                # whole list instead
+                rebuild.append(user_id)
+            elif evicted:
+                removed[user_id] = evicted
+
+        if removed:
+            try:
+                async with self.redis.pipeline() as pipeline:
+                    for user_id, evicted in removed.items():
+                        user_stats = total_stats([decode_message(raw)["c"] for raw in evicted])
+                        for field, value in user_stats.items():
+                            pipeline.hincrbyfloat(f"analytics_stats_{user_id}", field, -value)
+                    await pipeline.execute()
+            except Exception:
+                logger.exception("Failed to subtract evicted messages from running statistics")
+                rebuild.extend(removed.keys())
+
+        for user_id in rebuild:
+            try:
+                await self._rebuild_stats(user_id)
+            except Exception:
+                logger.exception(f"Failed to rebuild the running statistics of {user_id}")
+                await self._drop_stats(user_id)
+
+    async def _drop_stats(self, user_id: int):
+        """
+        Drops the running statistics of a user, which are possibly wrong, so that they are
+        rebuilt from their stored messages when next needed.
+        """
+        try:
+            await self.redis.delete(f"analytics_stats_{user_id}")
+        except Exception:
+            logger.exception(f"Failed to drop the running statistics of {user_id}")
 
-        key = f"messages_{message.author_id}"
-        body = json.dumps({
-            "c": message.content,
-            "dt": message.created_at.timestamp(),
-            "ch": message.channel_id
-        })
-        compressed = zlib.compress(body.encode())
+    @bridged
+    async def get_activity(self, guild_id: int, days: int,
+                           channel_id: Optional[int] = None) -> Tuple[float, np.ndarray]:
+        """
+        Gets the number of messages sent per hour in a guild over the last ``days`` (UTC) days,
+        today included.
+
+        :param channel_id: The channel to count messages in, or None for the whole guild.
+        :return: A (timestamp of the first hour, array of counts per hour) tuple.
+        """
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = today - datetime.timedelta(days=days - 1)
+        dates = [start + datetime.timedelta(days=i) for i in range(days)]
+
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for date in dates:
+                pipeline.hgetall(f"activity_{guild_id}_{date:%Y%m%d}")
+            buckets = await pipeline.execute()
+
+        counts = np.zeros(days * 24, dtype=np.int64)
+        for day, bucket in enumerate(buckets):
+            for field, count in bucket.items():
+                channel, hour = field.decode().split(":")
+                if channel_id is None or int(channel) == channel_id:
+                    counts[day * 24 + int(hour)] += int(count)
+
+        return start.replace(tzinfo=datetime.timezone.utc).timestamp(), counts
 
-        pipeline = self.redis.pipeline()
-        with pipeline:
-            pipeline.lpush(key, compressed)
-            pipeline.ltrim(key, 0, 5000)
-            pipeline.execute()
+    @bridged
+    async def start_xp_cooldown(self, guild_id: int, user_id: int, seconds: int) -> bool:
+        """
+        Starts the levelling XP cooldown for a user.
+
+        :return: False if the user is already on cooldown, True otherwise.
+        """
+        key = f"xp_cooldown_{guild_id}_{user_id}"
+        return bool(await self.redis.set(key, "\x07", nx=True, ex=seconds))
 
-    @async_thread
-    def get_messages(self, user: User):
+    async def get_messages(self, user: User):
         """
         Gets the messages for a user.
         """
-        key = f"messages_{user.id}"
-        l = self.redis.lrange(key, 0, 5000)
-        results = [json.loads(zlib.decompress(i).decode()) for i in l]
+        messages = await self.get_messages_bulk([user.id])
+        return messages[user.id]
+
+    @bridged
+    async def get_member_stats(self, user: User) -> Dict[str, float]:
+        """
+        Gets the running analytics statistics for a user.
+
+        :return: A dict of :data:`.STAT_FIELDS` to values, or an empty dict if there are none.
+        """
+        stats = await self.redis.hgetall(f"analytics_stats_{user.id}")
+        if not stats:
+            return await self._rebuild_stats(user.id)
+
+        return {field: float(stats.get(field.encode(), 0)) for field in STAT_FIELDS}
+
+    @bridged
+    async def _get_raw_messages_bulk(self, user_ids: List[int]) -> Dict[int, List[bytes]]:
+        """
+        Gets the stored messages of many users, pipelining the fetches in chunks.
+        """
+        results = {}
+        for chunk in chunked(user_ids, BULK_CHUNK_SIZE):
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for user_id in chunk:
+                    pipeline.lrange(f"messages_{user_id}", 0, MAX_MESSAGES)
+                results.update(zip(chunk, await pipeline.execute()))
+
         return results
+
+    async def get_messages_bulk(self, user_ids: Iterable[int]) -> Dict[int, List[dict]]:
+        """
+        Gets the messages for many users.
+
+        The fetches are pipelined in chunks, and the messages are decoded in worker processes.
+
+        :param user_ids: The user IDs to get the messages of.
+        :return: A dict of user_id -> list of messages.
+        """
+        raw = await self._get_raw_messages_bulk(list(user_ids))
+        return await _map_in_processes(_decode_messages_bulk, raw)
+
+    @bridged
+    async def _get_stats_bulk(self, user_ids: List[int]) -> Dict[int, Dict[str, float]]:
+        """
+        Gets the running statistics of many users, skipping users without any.
+        """
+        results = {}
+        for chunk in chunked(user_ids, BULK_CHUNK_SIZE):
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for user_id in chunk:
+                    pipeline.hgetall(f"analytics_stats_{user_id}")
+
+                for user_id, stats in zip(chunk, await pipeline.execute()):
+                    if stats:
+                        results[user_id] = {field: float(stats.get(field.encode(), 0))
+                                            for field in STAT_FIELDS}
+
+        return results
+
+    @bridged
+    async def _store_stats_bulk(self, stats: Dict[int, Dict[str, float]]):
+        """
+        Stores rebuilt running statistics, without overwriting any that were built meanwhile.
+        """
+        for chunk in chunked(list(stats.items()), BULK_CHUNK_SIZE):
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for user_id, user_stats in chunk:
+                    for field, value in user_stats.items():
+                        pipeline.hsetnx(f"analytics_stats_{user_id}", field, value)
+                await pipeline.execute()
+
+    async def get_member_stats_bulk(self, users: Iterable[User]) -> Dict[int, Dict[str, float]]:
+        """
+        Gets the running analytics statistics for many users, in a bounded number of round-trips.
+
+        :return: A dict of user_id -> statistics, skipping users without any messages.
+        """
+        user_ids = [user.id for user in users]
+        stats = await self._get_stats_bulk(user_ids)
+
+        missing = [user_id for user_id in user_ids if user_id not in stats]
+        if missing:
+            raw = await self._get_raw_messages_bulk(missing)
+            raw = {user_id: messages for (user_id, messages) in raw.items() if messages}
+            rebuilt = await _map_in_processes(_stats_bulk, raw)
+            await self._store_stats_bulk(rebuilt)
+            stats.update(rebuilt)
+
+        return stats
+
+    @bridged
+    async def get_plot(self, key: str) -> Optional[bytes]:
+        """
+        Gets a cached plot.
+
+        :param key: The plot key, from :func:`.plot_key`.
+        :return: The PNG bytes of the plot, or None if it isn't cached.
+        """
+        return await self.redis.get(f"plot_{key}")
+
+    @bridged
+    async def set_plot(self, key: str, data: bytes, ttl: int):
+        """
+        Caches a plot for ``ttl`` seconds.
+        """
+        await self.redis.set(f"plot_{key}", data, ex=ttl)
+
+    @bridged
+    async def get_api_response(self, key: str) -> Optional[bytes]:
+        """
+        Gets the content of a cached API response.
+        """
+        return await self.redis.get(key)
+
+    @bridged
+    async def set_api_response(self, key: str, content: bytes, ttl: int):
+        """
+        Caches the content of an API response for ``ttl`` seconds.
+        """
+        await self.redis.set(key, content, ex=ttl)
+
+    @bridged
+    async def has_xp_ranking(self, guild_id: int) -> bool:
+        """
+        Checks if the XP ranking sorted set for a guild has been built.
+        """
+        return bool(await self.redis.exists(f"xp_rank_{guild_id}", f"xp_empty_{guild_id}"))
+
+    @bridged
+    async def rebuild_xp_ranking(self, guild_id: int, scores: Dict[int, int], empty_ttl: int):
+        """
+        Atomically replaces the XP ranking sorted set for a guild.
+
+        Redis can't store an empty sorted set, so a guild without any ranked users is instead
+        marked as built for ``empty_ttl`` seconds.
+
+        :param guild_id: The guild ID to rebuild the ranking of.
+        :param scores: A dict of user_id -> xp.
+        :param empty_ttl: The number of seconds an empty ranking is marked as built for.
+        """
+        key = f"xp_rank_{guild_id}"
+        temp_key = f"xp_rebuild_{guild_id}"
+        empty_key = f"xp_empty_{guild_id}"
+
+        async with self.redis.pipeline() as pipeline:
+            pipeline.delete(temp_key)
+            for chunk in chunked(list(scores.items()), 10_000):
+                pipeline.zadd(temp_key, dict(chunk))
+
+            if scores:
+                pipeline.rename(temp_key, key)
+                pipeline.delete(empty_key)
+            else:
+                pipeline.delete(key)
+                pipeline.set(empty_key, "\x07", ex=empty_ttl)
+
+            await pipeline.execute()
+
+    @bridged
+    async def get_xp_ranking_guilds(self) -> List[int]:
+        """
+        Gets the IDs of every guild with an XP ranking sorted set.
+        """
+        return [int(key.decode()[len("xp_rank_"):])
+                async for key in self.redis.scan_iter(match="xp_rank_*", count=1000)]
+
+    @bridged
+    async def set_xp(self, guild_id: int, user_id: int, xp: int):
+        """
+        Sets the XP of a user in their guild's ranking, if it has been built.
+        """
+        await self._set_if_built(keys=[f"xp_rank_{guild_id}", f"xp_empty_{guild_id}"],
+                                 args=[xp, user_id])
+
+    @bridged
+    async def get_xp(self, guild_id: int, user_id: int) -> Optional[int]:
+        """
+        Gets the XP of a user from their guild's ranking.
+        """
+        score = await self.redis.zscore(f"xp_rank_{guild_id}", user_id)
+        return int(score) if score is not None else None
+
+    @bridged
+    async def get_xp_rank(self, guild_id: int, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """
+        Gets the ranking of a user.
+
+        Users with the same XP share a position, like :meth:`.RankIndex.rank_of_xp`.
+
+        :return: A (position, total, xp) tuple, or None if the user isn't ranked.
+        """
+        score = await self.redis.zscore(f"xp_rank_{guild_id}", user_id)
+        if score is None:
+            return None
+
+        xp = int(score)
+        position, total = await self.get_xp_rank_of_score(guild_id, xp)
+        return position, total, xp
+
+    @bridged
+    async def get_xp_rank_of_score(self, guild_id: int, xp: int) -> Tuple[int, int]:
+        """
+        Gets the position an XP value would be ranked at.
+
+        :return: A (position, total) tuple.
+        """
+        key = f"xp_rank_{guild_id}"
+        async with self.redis.pipeline() as pipeline:
+            pipeline.zcount(key, f"({xp}", "+inf")
+            pipeline.zcard(key)
+            above, total = await pipeline.execute()
+
+        return above + 1, total
+
+    @bridged
+    async def get_xp_count(self, guild_id: int) -> int:
+        """
+        Gets the number of users in a guild's ranking.
+        """
+        return await self.redis.zcard(f"xp_rank_{guild_id}")
+
+    @bridged
+    async def get_xp_range(self, guild_id: int, start: int, stop: int,
+                           descending: bool = True) -> List[Tuple[int, int]]:
+        """
+        Gets the (user_id, xp) pairs at positions ``[start, stop)`` of a guild's ranking.
+        """
+        key = f"xp_rank_{guild_id}"
+        if descending:
+            rows = await self.redis.zrevrange(key, start, stop - 1, withscores=True)
+        else:
+            rows = await self.redis.zrange(key, start, stop - 1, withscores=True)
+
+        return [(int(member), int(score)) for (member, score) in rows]
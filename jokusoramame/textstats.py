@@ -0,0 +1,207 @@
+"""
+Text statistics used by analytics.
+
+Statistics are computed for whole batches of messages at a time: the bodies are joined into one
+UTF-8 byte array, and every per-message figure is a segmented reduction over that array.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+#: The fields of a member's running analytics statistics.
+STAT_FIELDS = ("total", "count", "length", "entropy", "capitals")
+
+#: The number of messages to compute entropy for at once, which bounds the size of the
+#: (message, byte) histogram to 256 counts per message.
+ENTROPY_CHUNK_SIZE = 4096
+
+
+def byte_entropy(data: bytes) -> float:
+    """
+    Gets the Shannon entropy of some bytes, normalised to [0, 1] like
+    ``entropy.shannon_entropy``.
+    """
+    if not data:
+        return 0.0
+
+    return histogram_entropy(byte_histogram(data))
+
+
+def byte_histogram(data: bytes) -> np.ndarray:
+    """
+    Counts the occurrences of each byte value in some bytes.
+
+    :return: A 256-bin histogram, which can be summed across chunks of a stream.
+    """
+    return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+
+
+def histogram_entropy(histogram: np.ndarray) -> float:
+    """
+    Gets the normalised Shannon entropy from a 256-bin byte histogram.
+    """
+    total = histogram.sum()
+    if total == 0:
+        return 0.0
+
+    p = histogram[histogram > 0] / total
+    return float(-(p * np.log2(p)).sum() / 8)
+
+
+def _segment_entropy(segments: np.ndarray, data: np.ndarray,
+                     lengths: np.ndarray) -> np.ndarray:
+    """
+    Gets the normalised Shannon entropy of each segment of a byte array.
+
+    Uses H = log2(L) - (1/L) * sum(c * log2(c)), where c * log2(c) is summed per byte occurrence
+    as log2(c), so only one dense (segment, byte) histogram is needed.
+    """
+    keys = segments * 256 + data
+    counts = np.bincount(keys, minlength=len(lengths) * 256)
+    sums = np.bincount(segments, weights=np.log2(counts[keys]), minlength=len(lengths))
+
+    safe_lengths = np.maximum(lengths, 1)
+    entropies = np.log2(safe_lengths) - sums / safe_lengths
+    return np.where(lengths > 0, entropies, 0) / 8
+
+
+def batch_stats(contents: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    Gets the statistics of many message bodies at once.
+
+    :param contents: The contents of the messages.
+    :return: A dict of :data:`STAT_FIELDS` to arrays, with one value per message.
+    """
+    n = len(contents)
+    encoded = [content.encode("utf-8") for content in contents]
+    byte_lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=n)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    # the message each byte belongs to
+    segments = np.repeat(np.arange(n, dtype=np.int64), byte_lengths)
+
+    entropies = np.zeros(n)
+    offsets = np.concatenate(([0], np.cumsum(byte_lengths)))
+    for start in range(0, n, ENTROPY_CHUNK_SIZE):
+        stop = min(start + ENTROPY_CHUNK_SIZE, n)
+        chunk = slice(offsets[start], offsets[stop])
+        entropies[start:stop] = _segment_entropy(segments[chunk] - start, data[chunk],
+                                                 byte_lengths[start:stop])
+
+    # multi-byte UTF-8 sequences never contain ASCII bytes, so this matches ascii_uppercase
+    uppercase = (data >= ord("A")) & (data <= ord("Z"))
+    capitals = np.bincount(segments, weights=uppercase, minlength=n)
+
+    return {
+        "total": np.ones(n),
+        "count": (byte_lengths > 0).astype(np.float64),
+        "length": np.fromiter(map(len, contents), dtype=np.float64, count=n),
+        "entropy": entropies,
+        "capitals": capitals
+    }
+
+
+def total_stats(contents: Sequence[str]) -> Dict[str, float]:
+    """
+    Gets the summed statistics of many message bodies.
+    """
+    if not contents:
+        return dict.fromkeys(STAT_FIELDS, 0)
+
+    return {field: float(values.sum()) for (field, values) in batch_stats(contents).items()}
+
+
+def message_stats(content: str) -> Dict[str, float]:
+    """
+    Gets the statistics of a single message body.
+    """
+    return total_stats([content])
+
+
+class StatsTable(object):
+    """
+    The summarised statistics of many members, stored as one array per column rather than one
+    dict per member.
+    """
+
+    #: The summary columns, as produced by :meth:`.Analytics.summarise_stats`.
+    COLUMNS = ("message_count", "message_total", "total_entropy", "total_length",
+               "average_entropy", "average_length", "capitals")
+
+    #: The columns that are whole numbers.
+    INT_COLUMNS = frozenset(("message_count", "message_total", "total_length", "capitals"))
+
+    def __init__(self, user_ids: np.ndarray, columns: Dict[str, np.ndarray]):
+        """
+        :param user_ids: The user ID of each row.
+        :param columns: A dict of :data:`COLUMNS` to arrays, with one value per row.
+        """
+        self.user_ids = user_ids
+        self.columns = columns
+
+    @classmethod
+    def from_stats(cls, stats: Dict[int, Dict[str, float]]) -> 'StatsTable':
+        """
+        Builds a table from running statistics, skipping users without any messages.
+
+        :param stats: A dict of user_id -> dict of :data:`STAT_FIELDS` to values.
+        """
+        n = len(stats)
+        user_ids = np.fromiter(stats.keys(), dtype=np.int64, count=n)
+        raw = {field: np.fromiter((user_stats[field] for user_stats in stats.values()),
+                                  dtype=np.float64, count=n)
+               for field in STAT_FIELDS}
+
+        keep = raw["total"] > 0
+        total, entropy, length = raw["total"][keep], raw["entropy"][keep], raw["length"][keep]
+        return cls(user_ids[keep], {
+            "message_count": raw["count"][keep],
+            "message_total": total,
+            "total_entropy": entropy,
+            "total_length": length,
+            "average_entropy": entropy / total,
+            "average_length": length / total,
+            "capitals": raw["capitals"][keep]
+        })
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes used by the table's arrays.
+        """
+        return self.user_ids.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def row(self, index: int) -> dict:
+        """
+        Gets a single row of the table, as a dict of column -> value.
+        """
+        return {name: int(column[index]) if name in self.INT_COLUMNS else float(column[index])
+                for (name, column) in self.columns.items()}
+
+    def sum(self, name: str) -> float:
+        """
+        Gets the sum of a column.
+        """
+        return float(self.columns[name].sum())
+
+    def top(self, name: str, k: int, bottom: bool = False) -> List[Tuple[int, dict]]:
+        """
+        Gets the rows with the ``k`` highest (or lowest) values in a column, without sorting the
+        whole table.
+
+        :param name: The column to rank by.
+        :param k: The number of rows to get.
+        :param bottom: If the lowest values should be selected instead of the highest.
+        :return: A list of (user_id, row), in rank order.
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+
+        keys = self.columns[name] if bottom else -self.columns[name]
+        selected = np.argpartition(keys, k - 1)[:k]
+        selected = selected[np.argsort(keys[selected], kind="stable")]
+        return [(int(self.user_ids[index]), self.row(index)) for index in selected]
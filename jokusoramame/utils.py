@@ -3,6 +3,7 @@ Misc utilities.
 """
 # create the asyncio event loop
 import asyncio
+import functools
 import json
 from typing import Any, Generator, List, Sequence, Tuple
 
@@ -28,6 +29,19 @@ from curio import AsyncioLoop
 # create the asyncio bridge
 loop = AsyncioLoop(event_loop=asyncio.get_event_loop())
 
+
+def bridged(func):
+    """
+    Wraps an asyncio coroutine function so that it runs on the bridge loop, from curio.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await loop.run_asyncio(functools.partial(func, *args, **kwargs))
+
+    return wrapper
+
+
 intervals = (
     ('week', 604_800),  # 60 * 60 * 24 * 7
     ('day',   86_400),  # 60 * 60 * 24
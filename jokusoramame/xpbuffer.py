@@ -0,0 +1,180 @@
+"""
+Write-behind buffering of levelling XP.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import curio
+import logbook
+from asyncqlio import DatabaseInterface, Session
+from lru import LRU
+
+logger = logbook.Logger("Jokusoramame.xp")
+
+#: Applies a batch of buffered XP deltas in a single statement.
+FLUSH_SQL = """
+INSERT INTO user_xp (user_id, guild_id, xp, level)
+SELECT * FROM unnest({user_ids}::bigint[], {guild_ids}::bigint[], {xp}::integer[],
+                     {levels}::integer[])
+ON CONFLICT (user_id, guild_id) DO UPDATE
+SET xp = user_xp.xp + EXCLUDED.xp, level = GREATEST(user_xp.level, EXCLUDED.level);
+"""
+
+#: Loads the stored XP of a single user.
+LOAD_SQL = """
+SELECT xp, level FROM user_xp WHERE user_id = {user_id} AND guild_id = {guild_id};
+"""
+
+Key = Tuple[int, int]
+
+
+class XPBuffer(object):
+    """
+    Collects XP increments in memory and periodically writes them to the database in bulk.
+
+    The buffer also keeps the running totals of recently active users, so that level ups can be
+    detected against the buffered XP without waiting for a flush.
+    """
+
+    def __init__(self, db: DatabaseInterface, flush_interval: float = 5,
+                 cache_size: int = 50_000):
+        """
+        :param db: The :class:`.DatabaseInterface` to flush to.
+        :param flush_interval: The number of seconds between flushes.
+        :param cache_size: The maximum number of users to keep running totals for.
+        """
+        self.db = db
+        self.flush_interval = flush_interval
+
+        #: (guild_id, user_id) -> [xp, level] for recently active users.
+        self._totals = LRU(cache_size)
+
+        #: (guild_id, user_id) -> XP gained since the last flush.
+        self._pending: Dict[Key, int] = {}
+
+        #: (guild_id, user_id) -> level reached since the last flush.
+        self._levels: Dict[Key, int] = {}
+
+        #: (guild_id, user_id) -> (xp, level) being written by the flush in progress.
+        self._inflight: Dict[Key, Tuple[int, int]] = {}
+
+    async def _load(self, key: Key) -> List[int]:
+        """
+        Loads the running total for a user from the database.
+        """
+        guild_id, user_id = key
+        sess: Session = self.db.get_session()
+        async with sess:
+            row = await sess.fetch(LOAD_SQL, {"user_id": user_id, "guild_id": guild_id})
+
+        if row is None:
+            xp, level = 0, 1
+        else:
+            xp, level = row["xp"], row["level"]
+
+        # anything not flushed yet isn't in the row, including what's being flushed right now
+        inflight_xp, inflight_level = self._inflight.get(key, (0, 1))
+        return [xp + inflight_xp + self._pending.get(key, 0),
+                max(level, inflight_level, self._levels.get(key, 1))]
+
+    def peek(self, guild_id: int, user_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Gets the buffered (xp, level) of a user, if they are being tracked.
+        """
+        total = self._totals.get((guild_id, user_id))
+        if total is None:
+            return None
+
+        return total[0], total[1]
+
+    def guild_totals(self, guild_id: int) -> Iterator[Tuple[int, int]]:
+        """
+        Iterates over the buffered (user_id, xp) of every tracked user in a guild.
+        """
+        for (key_guild_id, user_id), (xp, _) in self._totals.items():
+            if key_guild_id == guild_id:
+                yield user_id, xp
+
+    async def add(self, guild_id: int, user_id: int, amount: int) -> Tuple[int, int]:
+        """
+        Adds XP to a user.
+
+        :param guild_id: The guild ID the XP is for.
+        :param user_id: The user ID the XP is for.
+        :param amount: The amount of XP to add.
+        :return: The buffered (xp, level) of the user, after adding.
+        """
+        key = (guild_id, user_id)
+        total = self._totals.get(key)
+        if total is None:
+            total = await self._load(key)
+            # another message might have loaded this user whilst we were waiting
+            total = self._totals.get(key) or total
+            self._totals[key] = total
+
+        total[0] += amount
+        self._pending[key] = self._pending.get(key, 0) + amount
+        return total[0], total[1]
+
+    def set_level(self, guild_id: int, user_id: int, level: int):
+        """
+        Records that a user has reached a new level.
+        """
+        key = (guild_id, user_id)
+        total = self._totals.get(key)
+        if total is not None:
+            total[1] = level
+
+        self._levels[key] = level
+
+    async def flush(self) -> int:
+        """
+        Writes all buffered XP to the database.
+
+        :return: The number of rows written.
+        """
+        if not self._pending and not self._levels:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        levels, self._levels = self._levels, {}
+        keys = pending.keys() | levels.keys()
+        # users loaded whilst this is being written still need it on top of their row
+        self._inflight = {key: (pending.get(key, 0), levels.get(key, 1)) for key in keys}
+
+        params = {"user_ids": [], "guild_ids": [], "xp": [], "levels": []}
+        for key, (xp, level) in self._inflight.items():
+            guild_id, user_id = key
+            params["user_ids"].append(user_id)
+            params["guild_ids"].append(guild_id)
+            params["xp"].append(xp)
+            params["levels"].append(level)
+
+        try:
+            sess: Session = self.db.get_session()
+            async with sess:
+                await sess.execute(FLUSH_SQL, params)
+        except Exception:
+            # put everything back so the next flush retries it
+            for key, amount in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + amount
+
+            for key, level in levels.items():
+                self._levels[key] = max(level, self._levels.get(key, 1))
+
+            raise
+        finally:
+            self._inflight = {}
+
+        logger.debug(f"Flushed XP for {len(keys)} users.")
+        return len(keys)
+
+    async def run(self):
+        """
+        Flushes the buffer every ``flush_interval`` seconds, forever.
+        """
+        while True:
+            await curio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush XP buffer")
@@ -0,0 +1,28 @@
+"""
+Autogenerated migration file.
+
+Revision: 5
+Message: Add user XP leaderboard index.
+"""
+from asyncqlio.orm.ddl.ddlsession import DDLSession
+
+revision = "5"
+message = "Add user XP leaderboard index."
+
+
+async def upgrade(session: DDLSession):
+    """
+    Performs an upgrade. Put your upgrading SQL here.
+    """
+    await session.execute("""
+    CREATE INDEX user_xp_guild_id_xp_id_idx ON user_xp (guild_id, xp, id);
+    """)
+
+
+async def downgrade(session: DDLSession):
+    """
+    Performs a downgrade. Put your downgrading SQL here.
+    """
+    await session.execute("""
+    DROP INDEX user_xp_guild_id_xp_id_idx;
+    """)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import shutil
@@ -5,14 +6,19 @@ import sys
 import traceback
 from ruamel import yaml
 
+import asyncpg
+import click
 import curio
 import multio
+import numpy as np
 from curio import TaskError
 from curious.exc import Unauthorized
 from logbook import StreamHandler
 from logbook.compat import redirect_logging
+from tqdm import tqdm
 
 from jokusoramame.bot import Jokusoramame
+from jokusoramame.plugins.levelling import INCREASING_FACTOR, get_levels_from_exp_array
 from jokusoramame.utils import loop
 
 # logging
@@ -30,14 +36,31 @@ seaborn.set_style("whitegrid")  # change seaborn style
 seaborn.set_palette(seaborn.color_palette("cubehelix", 16))  # change seaborn palette
 
 
+def load_config() -> dict:
+    """
+    Loads the config file.
+    """
+    with open("config.yml") as f:
+        return yaml.load(f, Loader=yaml.Loader)
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def cli(ctx: click.Context):
+    """
+    Runs the bot, or one of the maintenance commands.
+    """
+    if ctx.invoked_subcommand is None:
+        main()
+
+
 def main():
     if not os.path.exists("config.yml"):
         shutil.copy("config.example.yml", "config.yml")
         print("Copied config.example.yml to config.yml")
         return
 
-    with open("config.yml") as f:
-        config = yaml.load(f, Loader=yaml.Loader)
+    config = load_config()
 
     bot = Jokusoramame(config)
     try:
@@ -52,8 +75,81 @@ def main():
                     traceback.print_exception(None, task.next_exc, task.next_exc.__traceback__)
 
     finally:
+        # make sure no buffered XP or queued analytics messages are lost
+        try:
+            curio.run(bot.xp_buffer.flush())
+        except Exception:
+            traceback.print_exc()
+
+        try:
+            curio.run(bot.analytics_queue.flush())
+        except Exception:
+            traceback.print_exc()
+
+        curio.run(bot.redis.close())
+        bot.plots.close()
         curio.run(loop.shutdown())
 
 
+async def _recompute_levels(dsn: str, batch_size: int, factor: int) -> int:
+    """
+    Recomputes the level of every row in ``user_xp``.
+
+    :return: The number of rows that were changed.
+    """
+    conn: asyncpg.Connection = await asyncpg.connect(dsn)
+    try:
+        total = await conn.fetchval("SELECT COUNT(*) FROM user_xp;")
+        changed = 0
+
+        # server-side cursors only live inside a transaction
+        async with conn.transaction():
+            await conn.execute("CREATE TEMPORARY TABLE level_updates "
+                               "(id INTEGER PRIMARY KEY, level INTEGER NOT NULL) ON COMMIT DROP;")
+
+            cursor = await conn.cursor("SELECT id, xp, level FROM user_xp;")
+            with tqdm(total=total, unit="rows") as progress:
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+
+                    array = np.array(rows, dtype=np.int64)
+                    ids, xp, levels = array[:, 0], array[:, 1], array[:, 2]
+                    new_levels = get_levels_from_exp_array(xp, factor)
+
+                    mask = new_levels != levels
+                    if mask.any():
+                        records = zip(ids[mask].tolist(), new_levels[mask].tolist())
+                        await conn.copy_records_to_table("level_updates", records=records)
+                        changed += int(mask.sum())
+
+                    progress.update(len(rows))
+
+            await conn.execute("UPDATE user_xp SET level = level_updates.level "
+                               "FROM level_updates WHERE user_xp.id = level_updates.id;")
+    finally:
+        await conn.close()
+
+    return changed
+
+
+@cli.command(name="recompute-levels")
+@click.option("--batch-size", default=50_000, help="The number of rows to fetch at a time.")
+@click.option("--factor", default=INCREASING_FACTOR, help="The levelling up constant to use.")
+def recompute_levels(batch_size: int, factor: int):
+    """
+    Recomputes every stored level after changing the levelling curve.
+
+    The bot should not be running whilst this runs, or buffered levels may be written back.
+    """
+    config = load_config()
+    event_loop = asyncio.get_event_loop()
+    changed = event_loop.run_until_complete(
+        _recompute_levels(config["db_url"], batch_size, factor)
+    )
+    click.echo(f"Updated {changed} levels.")
+
+
 if __name__ == '__main__':
-    main()
+    cli()
@@ -0,0 +1,84 @@
+"""
+Tests for the level maths used by levelling.
+"""
+import random
+
+import numpy as np
+import pytest
+from numpy.polynomial import Polynomial
+
+from jokusoramame.plugins.levelling import INCREASING_FACTOR, get_level_from_exp, \
+    get_levels_from_exp_array, get_next_exp_required, get_next_exp_required_array
+
+MAX_XP = 10 ** 7
+
+#: XP values exactly on a level boundary, that the old solver put one level too low.
+FLOAT_BOUNDARY_ERRORS = [14250, 15750, 47250, 156000]
+
+
+def polynomial_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    The polynomial root solver that levelling used to run.
+    """
+    if xp < a:
+        return 1
+
+    root = Polynomial([-xp, a / 2, a / 2]).roots()[1] + 1
+    return int(np.floor(root))
+
+
+def level_boundary(level: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    Gets the total XP needed to reach a level.
+    """
+    return a * (level - 1) * level // 2
+
+
+def test_array_levels_are_exact():
+    xp = np.arange(MAX_XP, dtype=np.int64)
+    levels = get_levels_from_exp_array(xp)
+
+    assert levels.dtype == np.int64
+    assert (level_boundary(levels) <= xp).all()
+    assert (xp < level_boundary(levels + 1)).all()
+
+
+def test_scalar_matches_array():
+    values = random.Random(0).sample(range(MAX_XP), 20_000)
+    expected = get_levels_from_exp_array(np.array(values))
+    assert [get_level_from_exp(xp) for xp in values] == expected.tolist()
+
+
+def test_matches_polynomial_solver():
+    rng = random.Random(0)
+    values = rng.sample(range(MAX_XP), 20_000)
+    # and every level boundary, with its neighbours
+    level = 2
+    while level_boundary(level) < MAX_XP:
+        boundary = level_boundary(level)
+        values += [boundary - 1, boundary, boundary + 1]
+        level += 1
+
+    for xp in values:
+        old, new = polynomial_level_from_exp(xp), get_level_from_exp(xp)
+        if old != new:
+            # the float roots only ever fall just short of an exact boundary
+            assert xp == level_boundary(new)
+            assert old == new - 1
+
+
+@pytest.mark.parametrize("xp", FLOAT_BOUNDARY_ERRORS)
+def test_exact_boundaries(xp: int):
+    # the old solver was one level short here; reaching the boundary reaches the level
+    level = get_level_from_exp(xp)
+    assert polynomial_level_from_exp(xp) == level - 1
+    assert level_boundary(level) == xp
+    assert get_level_from_exp(xp - 1) == level - 1
+    assert get_next_exp_required(xp) == (level, level_boundary(level + 1) - xp)
+
+
+def test_next_exp_required_array():
+    xp = np.array([0, 1, 74, 75, 76] + FLOAT_BOUNDARY_ERRORS + [MAX_XP])
+    levels, required = get_next_exp_required_array(xp)
+    assert list(zip(levels.tolist(), required.tolist())) == \
+        [get_next_exp_required(value) for value in xp.tolist()]